@@ -154,6 +154,18 @@ Block Device can also be used for having more than one block storage device atta
           size: 100
           shutdown: <preserve/remove>
 
+An authenticated connection is reused by subsequent calls against the same
+provider. It is discarded and a new token is requested once it is older than
+``conn_cache_ttl`` seconds (600 by default). The results of ``list_nodes``
+and ``list_nodes_full`` can also be reused for ``nodes_cache_ttl`` seconds. This
+is disabled by default, the provider is queried on every call:
+
+.. code-block:: yaml
+
+    my-nova:
+      conn_cache_ttl: 300
+      nodes_cache_ttl: 10
+
 Note: You must include the default net-ids when setting networks or the server
 will be created without the rest of the interfaces
 
@@ -165,10 +177,13 @@ rackconnect v3 cloud network as its variable.
 # Import python libs
 from __future__ import absolute_import
 import os
+import copy
 import logging
 import socket
 import pprint
+import time
 import yaml
+from multiprocessing.pool import ThreadPool
 
 # Import Salt Libs
 import salt.ext.six as six
@@ -177,8 +192,11 @@ import salt.client
 from salt.utils.openstack import nova
 try:
     import novaclient.exceptions
+    # Errors of a call with a revoked or expired keystone token
+    AUTH_ERRORS = (novaclient.exceptions.Unauthorized,
+                   novaclient.exceptions.AuthorizationFailure)
 except ImportError as exc:
-    pass
+    AUTH_ERRORS = ()
 
 # Import Salt Cloud Libs
 from salt.cloud.libcloudfuncs import *  # pylint: disable=W0614,W0401
@@ -206,11 +224,32 @@ request_log = logging.getLogger('requests')
 
 __virtualname__ = 'nova'
 
+# Maximum number of concurrent server_show requests when the driver does not
+# offer a detailed server listing
+SERVER_SHOW_WORKERS = 16
+
+# Maximum number of volumes created and attached concurrently
+VOLUME_ATTACH_WORKERS = 8
+
+# Authenticated connections, keyed by provider name, so that subsequent calls
+# reuse the same HTTP connection pool and keystone token
+__CONN_CACHE = {}
+
+# Seconds an authenticated connection is reused before logging in again
+CONN_CACHE_TTL = 600
+
+# Recent server listings and list_nodes/list_nodes_full results, keyed by
+# provider and function
+__NODES_CACHE = {}
+
+# Seconds a node listing is served from __NODES_CACHE, 0 disables the cache
+NODES_CACHE_TTL = 0
+
 # Some of the libcloud functions need to be in the same namespace as the
 # functions defined in the module, so we create new function objects inside
 # this module namespace
 script = namespaced_function(script, globals())
-reboot = namespaced_function(reboot, globals())
+_libcloud_reboot = namespaced_function(reboot, globals())
 
 
 # Only load in this module if the Nova configurations are in place
@@ -254,12 +293,53 @@ def get_dependencies():
     )
 
 
+class _CachedConn(object):
+    '''
+    A cached connection. If a call fails because the keystone token was
+    revoked or has expired, the connection is dropped from the cache and the
+    call is retried once with a newly authenticated connection.
+    '''
+    def __init__(self, provider, conn):
+        self.provider = provider
+        self.conn = conn
+
+    def __getattr__(self, name):
+        attr = getattr(self.conn, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except AUTH_ERRORS as exc:
+                log.debug('Authentication failed with the cached connection, '
+                          'logging in again: %s', exc)
+                _drop_conn(self.provider, self)
+                return getattr(get_conn().conn, name)(*args, **kwargs)
+        return call
+
+
+def _drop_conn(provider, conn):
+    '''
+    Remove the connection from the cache, unless it was replaced already
+    '''
+    if __CONN_CACHE.get(provider, (None, None))[1] is conn:
+        del __CONN_CACHE[provider]
+
+
 def get_conn():
     '''
     Return a conn object for the passed VM data
     '''
     vm_ = get_configured_provider()
 
+    provider = __active_provider_name__ or __virtualname__
+    if provider in __CONN_CACHE:
+        timestamp, conn = __CONN_CACHE[provider]
+        if time.time() - timestamp < vm_.get('conn_cache_ttl', CONN_CACHE_TTL):
+            return conn
+        del __CONN_CACHE[provider]
+
     kwargs = vm_.copy()  # pylint: disable=E1103
 
     kwargs['username'] = vm_['user']
@@ -270,7 +350,8 @@ def get_conn():
     if 'password' in vm_:
         kwargs['password'] = vm_['password']
 
-    conn = nova.SaltNova(**kwargs)
+    conn = _CachedConn(provider, nova.SaltNova(**kwargs))
+    __CONN_CACHE[provider] = (time.time(), conn)
 
     return conn
 
@@ -508,6 +589,7 @@ def destroy(name, conn=None, call=None):
     ))
     log.info('Destroying VM: {0}'.format(name))
     ret = conn.delete(node.id)
+    _clear_nodes_cache()
     if ret:
         log.info('Destroyed VM: {0}'.format(name))
         # Fire destroy action
@@ -528,6 +610,16 @@ def destroy(name, conn=None, call=None):
     return False
 
 
+def reboot(name, conn=None):
+    '''
+    Reboot a single VM
+    '''
+    try:
+        return _libcloud_reboot(name, conn)
+    finally:
+        _clear_nodes_cache()
+
+
 def request_instance(vm_=None, call=None):
     '''
     Put together all of the information necessary to request an instance
@@ -644,6 +736,7 @@ def request_instance(vm_=None, call=None):
                 vm_['name'], exc
             )
         )
+    _clear_nodes_cache()
     if data.extra.get('password', None) is None and vm_.get('key_filename', None) is None:
         raise SaltCloudSystemExit('No password returned.  Set ssh_key_file.')
 
@@ -932,6 +1025,101 @@ def avail_sizes():
     return conn.flavor_list()
 
 
+def _nodes_cache_ttl():
+    '''
+    Return the number of seconds node listings are cached for the active
+    provider, 0 if they are not cached
+    '''
+    return get_configured_provider().get('nodes_cache_ttl', NODES_CACHE_TTL)
+
+
+def _get_cached_nodes(func):
+    '''
+    Return a copy of the result of a recent call to ``func`` for the active
+    provider, or None if there is no result younger than ``nodes_cache_ttl``
+    '''
+    key = (__active_provider_name__ or __virtualname__, func)
+    if key not in __NODES_CACHE:
+        return None
+    timestamp, nodes = __NODES_CACHE[key]
+    if time.time() - timestamp < _nodes_cache_ttl():
+        # the caller may modify the result, keep the cached one intact
+        return copy.deepcopy(nodes)
+    del __NODES_CACHE[key]
+    return None
+
+
+def _set_cached_nodes(func, nodes):
+    '''
+    Remember a copy of the result of ``func`` for the active provider if node
+    listings are cached
+    '''
+    if _nodes_cache_ttl() <= 0:
+        return
+    key = (__active_provider_name__ or __virtualname__, func)
+    __NODES_CACHE[key] = (time.time(), copy.deepcopy(nodes))
+
+
+def _clear_nodes_cache():
+    '''
+    Forget all cached node listings, used when nodes or volumes change
+    '''
+    __NODES_CACHE.clear()
+
+
+def _server_list_detail(conn):
+    '''
+    Return the detailed listing of all servers, keyed by server name, using a
+    single request instead of one ``server_show`` call per server.
+
+    Falls back to the per-server lookups if the driver does not provide a
+    detailed listing.
+    '''
+    server_list_detailed = getattr(conn, 'server_list_detailed', None)
+    if server_list_detailed is not None:
+        try:
+            return server_list_detailed()
+        except AttributeError:
+            raise SaltCloudSystemExit(
+                'Corrupt server in server_list_detailed. Remove corrupt servers.'
+            )
+
+    server_list = conn.server_list()
+    if not server_list:
+        return {}
+
+    def _show(server):
+        return server, conn.server_show(server_list[server]['id']).get(server)
+
+    # The per-server lookups are independent blocking HTTP requests, so
+    # overlap them in a small thread pool
+    pool = ThreadPool(min(len(server_list), SERVER_SHOW_WORKERS))
+    try:
+        results = pool.map(_show, list(server_list))
+    finally:
+        pool.close()
+        pool.join()
+
+    ret = {}
+    for server, server_tmp in results:
+        # If the server is deleted while looking it up, skip
+        if server_tmp is not None:
+            ret[server] = server_tmp
+    return ret
+
+
+def _cached_server_list(conn):
+    '''
+    Return the detailed server listing, shared between list_nodes and
+    list_nodes_full for up to ``nodes_cache_ttl`` seconds
+    '''
+    server_list = _get_cached_nodes('server_list')
+    if server_list is None:
+        server_list = _server_list_detail(conn)
+        _set_cached_nodes('server_list', server_list)
+    return server_list
+
+
 def list_nodes(call=None, **kwargs):
     '''
     Return a list of the VMs that in this location
@@ -941,34 +1129,34 @@ def list_nodes(call=None, **kwargs):
             'The list_nodes function must be called with -f or --function.'
         )
 
+    cached = _get_cached_nodes('list_nodes')
+    if cached is not None:
+        return cached
+
     ret = {}
     conn = get_conn()
-    server_list = conn.server_list()
+    server_list = _cached_server_list(conn)
 
     if not server_list:
         return {}
+    is_public_ip = salt.utils.cloud.is_public_ip
     for server in server_list:
-        server_tmp = conn.server_show(server_list[server]['id']).get(server)
-
-        # If the server is deleted while looking it up, skip
-        if server_tmp is None:
-            continue
+        server_tmp = server_list[server]
 
         private = []
         public = []
-        if 'addresses' not in server_tmp:
-            server_tmp['addresses'] = {}
-        for network in server_tmp['addresses'].keys():
-            for address in server_tmp['addresses'][network]:
-                if salt.utils.cloud.is_public_ip(address.get('addr', '')):
-                    public.append(address['addr'])
-                elif ':' in address['addr']:
-                    public.append(address['addr'])
-                elif '.' in address['addr']:
-                    private.append(address['addr'])
+        for network in six.itervalues(server_tmp.get('addresses', {})):
+            for address in network:
+                addr = address.get('addr')
+                if not addr:
+                    continue
+                if is_public_ip(addr) or ':' in addr:
+                    public.append(addr)
+                elif '.' in addr:
+                    private.append(addr)
 
         if server_tmp['accessIPv4']:
-            if salt.utils.cloud.is_public_ip(server_tmp['accessIPv4']):
+            if is_public_ip(server_tmp['accessIPv4']):
                 public.append(server_tmp['accessIPv4'])
             else:
                 private.append(server_tmp['accessIPv4'])
@@ -983,6 +1171,7 @@ def list_nodes(call=None, **kwargs):
             'private_ips': private,
             'public_ips': public,
         }
+    _set_cached_nodes('list_nodes', ret)
     return ret
 
 
@@ -998,21 +1187,28 @@ def list_nodes_full(call=None, **kwargs):
             )
         )
 
+    cached = _get_cached_nodes('list_nodes_full')
+    if cached is not None:
+        return cached
+
     ret = {}
     conn = get_conn()
-    server_list = conn.server_list()
+    server_list = _cached_server_list(conn)
 
     if not server_list:
         return {}
+    password = getattr(conn, 'password', None)
     for server in server_list:
-        try:
-            ret[server] = conn.server_show_libcloud(
-                server_list[server]['id']
-            ).__dict__
-        except IndexError as exc:
-            ret = {}
+        if not server_list[server].get('id'):
+            continue
+        ret[server] = vars(nova.NovaServer(
+            server,
+            server_list[server],
+            password
+        ))
 
     __utils__['cloud.cache_node_list'](ret, __active_provider_name__.split(':')[0], __opts__)
+    _set_cached_nodes('list_nodes_full', ret)
     return ret
 
 
@@ -1035,7 +1231,9 @@ def volume_create(name, size=100, snapshot=None, voltype=None, **kwargs):
                      'snapshot': snapshot,
                      'voltype': voltype}
     create_kwargs['availability_zone'] = kwargs.get('availability_zone', None)
-    return conn.volume_create(**create_kwargs)
+    ret = conn.volume_create(**create_kwargs)
+    _clear_nodes_cache()
+    return ret
 
 
 # Command parity with EC2 and Azure
@@ -1047,7 +1245,9 @@ def volume_delete(name, **kwargs):
     Delete block storage device
     '''
     conn = get_conn()
-    return conn.volume_delete(name)
+    ret = conn.volume_delete(name)
+    _clear_nodes_cache()
+    return ret
 
 
 def volume_detach(name, **kwargs):
@@ -1055,10 +1255,12 @@ def volume_detach(name, **kwargs):
     Detach block volume
     '''
     conn = get_conn()
-    return conn.volume_detach(
+    ret = conn.volume_detach(
         name,
         timeout=300
     )
+    _clear_nodes_cache()
+    return ret
 
 
 def volume_attach(name, server_name, device='/dev/xvdb', **kwargs):
@@ -1066,12 +1268,14 @@ def volume_attach(name, server_name, device='/dev/xvdb', **kwargs):
     Attach block volume
     '''
     conn = get_conn()
-    return conn.volume_attach(
+    ret = conn.volume_attach(
         name,
         server_name,
         device,
         timeout=300
     )
+    _clear_nodes_cache()
+    return ret
 
 
 # Command parity with EC2 and Azure
@@ -1093,48 +1297,71 @@ def volume_create_attach(name, call=None, **kwargs):
     else:
         volumes = kwargs['volumes']
 
-    ret = []
-    for volume in volumes:
-        created = False
+    if not volumes:
+        return []
 
-        volume_dict = {
-            'name': volume['name'],
-        }
-        if 'volume_id' in volume:
-            volume_dict['volume_id'] = volume['volume_id']
-        elif 'snapshot' in volume:
-            volume_dict['snapshot'] = volume['snapshot']
-        else:
-            volume_dict['size'] = volume['size']
-
-            if 'type' in volume:
-                volume_dict['type'] = volume['type']
-            if 'iops' in volume:
-                volume_dict['iops'] = volume['iops']
-
-        if 'id' not in volume_dict:
-            created_volume = create_volume(**volume_dict)
-            created = True
-            volume_dict.update(created_volume)
-
-        attach = attach_volume(
-            name=volume['name'],
-            server_name=name,
-            device=volume.get('device', None),
-            call='action'
+    # Each volume is created and attached with its own blocking requests, so
+    # handle the volumes concurrently
+    pool = ThreadPool(min(len(volumes), VOLUME_ATTACH_WORKERS))
+    try:
+        results = pool.map(
+            lambda volume: _volume_create_attach(name, volume),
+            volumes
         )
+    finally:
+        pool.close()
+        pool.join()
+        # some volumes may be attached even if others failed
+        _clear_nodes_cache()
 
-        if attach:
-            msg = (
-                '{0} attached to {1} (aka {2})'.format(
-                    volume_dict['id'],
-                    name,
-                    volume_dict['name'],
-                )
+    return [msg for msg in results if msg]
+
+
+def _volume_create_attach(name, volume):
+    '''
+    Create a single volume if needed and attach it to the named node. Return
+    a message describing the attachment, or None if it failed.
+    '''
+    created = False
+
+    volume_dict = {
+        'name': volume['name'],
+    }
+    if 'volume_id' in volume:
+        volume_dict['volume_id'] = volume['volume_id']
+    elif 'snapshot' in volume:
+        volume_dict['snapshot'] = volume['snapshot']
+    else:
+        volume_dict['size'] = volume['size']
+
+        if 'type' in volume:
+            volume_dict['type'] = volume['type']
+        if 'iops' in volume:
+            volume_dict['iops'] = volume['iops']
+
+    if 'id' not in volume_dict:
+        created_volume = create_volume(**volume_dict)
+        created = True
+        volume_dict.update(created_volume)
+
+    attach = attach_volume(
+        name=volume['name'],
+        server_name=name,
+        device=volume.get('device', None),
+        call='action'
+    )
+
+    if attach:
+        msg = (
+            '{0} attached to {1} (aka {2})'.format(
+                volume_dict['id'],
+                name,
+                volume_dict['name'],
             )
-            log.info(msg)
-            ret.append(msg)
-    return ret
+        )
+        log.info(msg)
+        return msg
+    return None
 
 
 # Command parity with EC2 and Azure
@@ -1162,7 +1389,9 @@ def network_create(name, **kwargs):
     Create private networks
     '''
     conn = get_conn()
-    return conn.network_create(name, **kwargs)
+    ret = conn.network_create(name, **kwargs)
+    _clear_nodes_cache()
+    return ret
 
 
 def virtual_interface_list(name, **kwargs):
@@ -1178,4 +1407,6 @@ def virtual_interface_create(name, net_name, **kwargs):
     Create private networks
     '''
     conn = get_conn()
-    return conn.virtual_interface_create(name, net_name)
+    ret = conn.virtual_interface_create(name, net_name)
+    _clear_nodes_cache()
+    return ret
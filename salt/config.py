@@ -86,6 +86,10 @@ VALID_OPTS = {
     # Selects a random master when starting a minion up in multi-master mode
     'master_shuffle': bool,
 
+    # With master_type failover, connect to all of the masters at once and use
+    # the first one which accepts the connection
+    'master_parallel_connect': bool,
+
     # When in multi-master mode, temporarily remove a master from the list if a conenction
     # is interrupted and try another master in the list.
     'master_alive_interval': int,
@@ -233,6 +237,10 @@ VALID_OPTS = {
     # Whether or not processes should be forked when needed. The alternative is to use threading.
     'multiprocessing': bool,
 
+    # Maximum number of concurrently active job processes on the minion;
+    # a value <= 0 means no limit
+    'process_count_max': int,
+
     # Whether or not the salt minion should run scheduled mine updates
     'mine_enabled': bool,
 
@@ -365,6 +373,10 @@ VALID_OPTS = {
     # salt master
     'retry_dns': float,
 
+    # The number of seconds a successful resolution of the master hostname is
+    # reused before resolving it again. 0 disables the cache.
+    'dns_cache_ttl': int,
+
     # set the zeromq_reconnect_ivl option on the minion.
     # http://lists.zeromq.org/pipermail/zeromq-dev/2011-January/008845.html
     'recon_max': float,
@@ -702,6 +714,10 @@ VALID_OPTS = {
     # The length that the syndic event queue must hit before events are popped off and forwarded
     'syndic_jid_forward_cache_hwm': int,
 
+    # The number of aggregated events and returns which makes the syndic forward them before
+    # syndic_event_forward_timeout expires, 0 only forwards on the timer
+    'syndic_event_forward_max': int,
+
     'ssh_passwd': str,
     'ssh_port': str,
     'ssh_sudo': bool,
@@ -798,6 +814,7 @@ DEFAULT_MINION_OPTS = {
     'master_port': 4506,
     'master_finger': '',
     'master_shuffle': False,
+    'master_parallel_connect': False,
     'master_alive_interval': 0,
     'verify_master_pubkey_sign': False,
     'always_verify_signature': False,
@@ -895,6 +912,7 @@ DEFAULT_MINION_OPTS = {
     'auto_accept': True,
     'autosign_timeout': 120,
     'multiprocessing': True,
+    'process_count_max': -1,
     'mine_enabled': True,
     'mine_return_job': False,
     'mine_interval': 60,
@@ -933,6 +951,7 @@ DEFAULT_MINION_OPTS = {
     'update_url': False,
     'update_restart_services': [],
     'retry_dns': 30,
+    'dns_cache_ttl': 600,
     'recon_max': 10000,
     'recon_default': 1000,
     'recon_randomize': True,
@@ -1201,6 +1220,7 @@ DEFAULT_MASTER_OPTS = {
     'syndic_event_forward_timeout': 0.5,
     'syndic_max_event_process_time': 0.5,
     'syndic_jid_forward_cache_hwm': 100,
+    'syndic_event_forward_max': 1000,
     'ssh_passwd': '',
     'ssh_port': '22',
     'ssh_sudo': False,
@@ -792,22 +792,28 @@ class RemoteFuncs(object):
         Receive a syndic minion return and format it to look like returns from
         individual minions.
         '''
-        # Verify the load
-        if any(key not in load for key in ('return', 'jid', 'id')):
-            return None
-        # if we have a load, save it
-        if 'load' in load:
-            fstr = '{0}.save_load'.format(self.opts['master_job_cache'])
-            self.mminion.returners[fstr](load['jid'], load['load'])
-
-        # Format individual return loads
-        for key, item in six.iteritems(load['return']):
-            ret = {'jid': load['jid'],
-                   'id': key,
-                   'return': item}
-            if 'out' in load:
-                ret['out'] = load['out']
-            self._return(ret)
+        loads = load.get('load')
+        if not isinstance(loads, list):
+            # A single return, syndics which do not batch their returns send
+            # the job load in 'load'
+            loads = [load]
+        for load in loads:
+            # Verify the load
+            if any(key not in load for key in ('return', 'jid', 'id')):
+                continue
+            # if we have a load, save it
+            if 'load' in load:
+                fstr = '{0}.save_load'.format(self.opts['master_job_cache'])
+                self.mminion.returners[fstr](load['jid'], load['load'])
+
+            # Format individual return loads
+            for key, item in six.iteritems(load['return']):
+                ret = {'jid': load['jid'],
+                       'id': key,
+                       'return': item}
+                if 'out' in load:
+                    ret['out'] = load['out']
+                self._return(ret)
 
     def minion_runner(self, load):
         '''
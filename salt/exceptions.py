@@ -5,12 +5,12 @@ This module is a central location for all salt exceptions
 from __future__ import absolute_import
 
 # Import python libs
-import copy
 import logging
 import time
 
 # Import salt libs
 import salt.defaults.exitcodes
+import salt.ext.six as six
 
 log = logging.getLogger(__name__)
 
@@ -35,7 +35,10 @@ class SaltException(Exception):
         Pack this exception into a serializable dictionary that is safe for
         transport via msgpack
         '''
-        return dict(message=self.__unicode__(), args=self.args)
+        message = self.strerror
+        if not isinstance(message, six.string_types):
+            message = six.text_type(self)
+        return dict(message=message, args=self.args)
 
 
 class SaltClientError(SaltException):
@@ -171,14 +174,15 @@ class SaltRenderError(SaltException):
                  marker='    <======================',
                  trace=None):
         self.error = message
-        exc_str = copy.deepcopy(message)
+        exc_str = message
         self.line_num = line_num
         self.buffer = buf
         self.context = ''
         if trace:
             exc_str += '\n{0}\n'.format(trace)
         if self.line_num and self.buffer:
-
+            # The context is part of args, so that every consumer of the
+            # message gets it. Only import salt.utils when it is needed.
             import salt.utils
             self.context = salt.utils.get_context(
                 self.buffer,
@@ -288,9 +292,15 @@ class SaltCloudSystemExit(SaltCloudException):
     '''
     def __init__(self, message, exit_code=salt.defaults.exitcodes.EX_GENERIC):
         SaltCloudException.__init__(self, message)
-        self.message = message
         self.exit_code = exit_code
 
+    @property
+    def message(self):
+        '''
+        The message passed when raising, kept as ``strerror``
+        '''
+        return self.strerror
+
 
 class SaltCloudConfigError(SaltCloudException):
     '''
@@ -6,17 +6,21 @@ Routines to set up a minion
 from __future__ import absolute_import, print_function
 import os
 import re
+import errno
 import sys
 import copy
 import time
 import types
 import signal
 import fnmatch
+import contextlib
+import collections
 import logging
 import threading
+import weakref
 import traceback
 import multiprocessing
-from random import randint, shuffle
+from random import randint, sample, shuffle
 from salt.config import DEFAULT_MINION_OPTS
 from stat import S_IMODE
 
@@ -28,6 +32,7 @@ if six.PY3:
 else:
     import salt.ext.ipaddress as ipaddress
 from salt.ext.six.moves import range
+from salt.ext.six.moves import cPickle as pickle
 # pylint: enable=no-name-in-module,redefined-builtin
 
 # Import third party libs
@@ -43,6 +48,19 @@ except ImportError:
     # Running in local, zmq not needed
     HAS_ZMQ = False
 
+# ZMQ < 3.2 has known connection keep-alive issues, warn about it once
+ZMQ_TOO_OLD = False
+if HAS_ZMQ:
+    try:
+        ZMQ_TOO_OLD = zmq.zmq_version_info() < (3, 2)
+    except AttributeError:
+        # PyZMQ <= 2.1.9 does not have zmq_version_info, fall back to
+        # using zmq.zmq_version() and build a version info tuple.
+        ZMQ_TOO_OLD = tuple(
+            [int(x) for x in zmq.zmq_version().split('.')]
+        ) < (3, 2)
+_ZMQ_WARNED = False
+
 HAS_RANGE = False
 try:
     import seco.range
@@ -74,6 +92,7 @@ except ImportError:
 # Import salt libs
 import salt
 import salt.client
+import salt.log
 import salt.crypt
 import salt.loader
 import salt.beacons
@@ -95,6 +114,7 @@ import salt.cli.daemons
 from salt.defaults import DEFAULT_TARGET_DELIM
 from salt.utils.debug import enable_sigusr1_handler
 from salt.utils.event import tagify
+from salt.utils.odict import OrderedDict
 from salt.exceptions import (
     CommandExecutionError,
     CommandNotFoundError,
@@ -107,6 +127,7 @@ from salt.exceptions import (
 
 
 import tornado.gen  # pylint: disable=F0401
+import tornado.concurrent  # pylint: disable=F0401
 import tornado.ioloop  # pylint: disable=F0401
 
 log = logging.getLogger(__name__)
@@ -119,59 +140,78 @@ log = logging.getLogger(__name__)
 # 5. Connect to the publisher
 # 6. Handle publications
 
+# os.chown is only available on unix/unix like systems
+_HAS_CHOWN = hasattr(os, 'chown')
 
-def resolve_dns(opts):
+# Successful master hostname resolutions, keyed by (master, ipv6)
+_DNS_CACHE = {}
+
+
+def _dns_check(opts):
     '''
-    Resolves the master_ip and master_uri options
+    Resolve the master hostname, reusing a previous successful resolution for
+    up to ``dns_cache_ttl`` seconds
     '''
-    ret = {}
-    check_dns = True
-    if (opts.get('file_client', 'remote') == 'local' and
-            not opts.get('use_master_when_local', False)):
-        check_dns = False
-
-    if check_dns is True:
-        # Because I import salt.log below I need to re-import salt.utils here
-        import salt.utils
-        try:
-            if opts['master'] == '':
-                raise SaltSystemExit
-            ret['master_ip'] = \
-                    salt.utils.dns_check(opts['master'], True, opts['ipv6'])
-        except SaltClientError:
-            if opts['retry_dns']:
-                while True:
-                    import salt.log
-                    msg = ('Master hostname: \'{0}\' not found. Retrying in {1} '
-                           'seconds').format(opts['master'], opts['retry_dns'])
-                    if salt.log.is_console_configured():
-                        log.error(msg)
-                    else:
-                        print('WARNING: {0}'.format(msg))
-                    time.sleep(opts['retry_dns'])
-                    try:
-                        ret['master_ip'] = salt.utils.dns_check(
-                            opts['master'], True, opts['ipv6']
-                        )
-                        break
-                    except SaltClientError:
-                        pass
-            else:
-                ret['master_ip'] = '127.0.0.1'
-        except SaltSystemExit:
-            unknown_str = 'unknown address'
-            master = opts.get('master', unknown_str)
-            if master == '':
-                master = unknown_str
-            if opts.get('__role') == 'syndic':
-                err = 'Master address: \'{0}\' could not be resolved. Invalid or unresolveable address. Set \'syndic_master\' value in minion config.'.format(master)
-            else:
-                err = 'Master address: \'{0}\' could not be resolved. Invalid or unresolveable address. Set \'master\' value in minion config.'.format(master)
-            log.error(err)
-            raise SaltSystemExit(code=42, msg=err)
+    key = (opts['master'], opts['ipv6'])
+    ttl = opts.get('dns_cache_ttl', 0)
+    if ttl and key in _DNS_CACHE:
+        timestamp, master_ip = _DNS_CACHE[key]
+        if time.time() - timestamp < ttl:
+            return master_ip
+    master_ip = salt.utils.dns_check(opts['master'], True, opts['ipv6'])
+    _DNS_CACHE[key] = (time.time(), master_ip)
+    return master_ip
+
+
+def _dns_confirmed(opts):
+    '''
+    Renew the cached resolution of the master once a connection to the
+    resolved address succeeded, so that later failovers keep using this last
+    known good address without asking DNS
+    '''
+    key = (opts['master'], opts['ipv6'])
+    cached = _DNS_CACHE.get(key)
+    if cached is not None and cached[1] == opts.get('master_ip'):
+        _DNS_CACHE[key] = (time.time(), cached[1])
+
+
+def _needs_dns(opts):
+    '''
+    Return False if the minion runs masterless and never contacts a master
+    '''
+    return not (opts.get('file_client', 'remote') == 'local' and
+                not opts.get('use_master_when_local', False))
+
+
+def _unresolvable_master(opts):
+    '''
+    Log and raise the error for a master address which cannot be resolved
+    '''
+    unknown_str = 'unknown address'
+    master = opts.get('master', unknown_str)
+    if master == '':
+        master = unknown_str
+    if opts.get('__role') == 'syndic':
+        err = 'Master address: \'{0}\' could not be resolved. Invalid or unresolveable address. Set \'syndic_master\' value in minion config.'.format(master)
     else:
-        ret['master_ip'] = '127.0.0.1'
+        err = 'Master address: \'{0}\' could not be resolved. Invalid or unresolveable address. Set \'master\' value in minion config.'.format(master)
+    log.error(err)
+    raise SaltSystemExit(code=42, msg=err)
+
+
+def _log_dns_retry(opts, retry_in):
+    msg = ('Master hostname: \'{0}\' not found. Retrying in {1} '
+           'seconds').format(opts['master'], retry_in)
+    if salt.log.is_console_configured():
+        log.error(msg)
+    else:
+        print('WARNING: {0}'.format(msg))
+
 
+def _master_uri(opts, ret):
+    '''
+    Add the master_uri for the resolved master_ip in ret and return ret
+    '''
     if 'master_ip' in ret and 'master_ip' in opts:
         if ret['master_ip'] != opts['master_ip']:
             log.warning('Master ip address changed from {0} to {1}'.format(opts['master_ip'],
@@ -182,24 +222,227 @@ def resolve_dns(opts):
     return ret
 
 
+def _resolve_master_ip(opts, ret):
+    '''
+    Resolve the master_ip option into ret. This is a generator yielding the
+    number of seconds to wait before each DNS retry, so that the caller can
+    wait with the sleep fitting it. The wait starts at retry_dns seconds and
+    doubles up to a minute (or retry_dns if that is longer).
+    '''
+    if not _needs_dns(opts):
+        ret['master_ip'] = '127.0.0.1'
+        return
+    try:
+        if opts['master'] == '':
+            raise SaltSystemExit
+        ret['master_ip'] = _dns_check(opts)
+        return
+    except SaltClientError:
+        if not opts['retry_dns']:
+            ret['master_ip'] = '127.0.0.1'
+            return
+    except SaltSystemExit:
+        _unresolvable_master(opts)
+
+    retry_in = opts['retry_dns']
+    max_retry_in = max(opts['retry_dns'], 60)
+    while True:
+        _log_dns_retry(opts, retry_in)
+        yield retry_in
+        try:
+            ret['master_ip'] = _dns_check(opts)
+            return
+        except SaltClientError:
+            retry_in = min(retry_in * 2, max_retry_in)
+
+
+def resolve_dns(opts):
+    '''
+    Resolves the master_ip and master_uri options
+    '''
+    ret = {}
+    for retry_in in _resolve_master_ip(opts, ret):
+        time.sleep(retry_in)
+    return _master_uri(opts, ret)
+
+
+@tornado.gen.coroutine
+def resolve_dns_async(opts):
+    '''
+    Resolves the master_ip and master_uri options like resolve_dns, but
+    waits between DNS retries on the IO loop instead of blocking it
+    '''
+    ret = {}
+    for retry_in in _resolve_master_ip(opts, ret):
+        yield tornado.gen.sleep(retry_in)
+    raise tornado.gen.Return(_master_uri(opts, ret))
+
+
+@contextlib.contextmanager
+def _modules_max_memory(opts):
+    '''
+    Enforce the modules_max_memory limit on the address space of the process
+    while loading modules and restore the previous limit afterwards. This
+    only works on *nix like OSs, the resource module is not available on
+    Windows.
+    '''
+    max_memory = opts.get('modules_max_memory', -1)
+    if max_memory <= 0:
+        yield
+        return
+    if not HAS_PSUTIL or not HAS_RESOURCE:
+        if not HAS_PSUTIL:
+            log.error('Unable to enforce modules_max_memory because psutil is missing')
+        if not HAS_RESOURCE:
+            log.error('Unable to enforce modules_max_memory because resource is missing')
+        yield
+        return
+
+    log.debug('modules_max_memory set, enforcing a maximum of %s', max_memory)
+    old_mem_limit = resource.getrlimit(resource.RLIMIT_AS)
+    rss, vms = psutil.Process(os.getpid()).memory_info()
+    mem_limit = rss + vms + max_memory
+    resource.setrlimit(resource.RLIMIT_AS, (mem_limit, mem_limit))
+    try:
+        yield
+    finally:
+        # we're done, reset the limits!
+        resource.setrlimit(resource.RLIMIT_AS, old_mem_limit)
+
+
+def _update_changed(opts, new_opts):
+    '''
+    Update opts with the values in new_opts, only writing keys whose value
+    actually changed. On reconnects the resolved master usually stays the
+    same, so this is normally a no-op.
+    '''
+    for key, val in six.iteritems(new_opts):
+        if key not in opts or opts[key] != val:
+            opts[key] = val
+
+
+# Splits a master address into the host and an optional numeric port. An IPv6
+# address only gets a port when it is in brackets, a bare address with more
+# than one colon is taken as the host as a whole.
+_MASTER_ADDR_RE = re.compile(
+    r'^(?:\[(?P<bracketed>[^\]]+)\](?::(?P<port>\d+))?'
+    r'|(?P<ipv6>[^:]*:[^:]*:.*)'
+    r'|(?P<host>[^:]*)(?::(?P<host_port>\d+))?)$',
+    re.DOTALL
+)
+
+
 def prep_ip_port(opts):
     ret = {}
     if opts['master_uri_format'] == 'ip_only':
         ret['master'] = opts['master']
     else:
-        ip_port = opts['master'].rsplit(":", 1)
-        if len(ip_port) == 1:
-            # e.g. master: mysaltmaster
-            ret['master'] = ip_port[0]
+        # e.g. master: mysaltmaster
+        # e.g. master: localhost:1234
+        # e.g. master: 127.0.0.1:1234
+        # e.g. master: ::1
+        # e.g. master: [::1]:1234
+        match = _MASTER_ADDR_RE.match(opts['master'])
+        if match is None:
+            # e.g. master: localhost:salt, not a port
+            ret['master'] = opts['master']
         else:
-            # e.g. master: localhost:1234
-            # e.g. master: 127.0.0.1:1234
-            # e.g. master: ::1:1234
-            ret['master'] = ip_port[0]
-            ret['master_port'] = ip_port[1]
+            ret['master'] = (match.group('bracketed') or match.group('ipv6')
+                             or match.group('host'))
+            port = match.group('port') or match.group('host_port')
+            if port:
+                ret['master_port'] = port
     return ret
 
 
+# Seconds between the checks for a free job slot when process_count_max is hit
+_PROCESS_COUNT_INTERVAL = 1
+
+# The progress events of a job returning a generator are sent to the master
+# in batches of up to this many events, a batch which is not full is sent at
+# most this many seconds after its first event
+_PROG_EVENT_BATCH = 16
+_PROG_EVENT_INTERVAL = 1
+
+class _ProgEventBatch(object):
+    '''
+    Collect the progress events of a job and send them to the master in
+    batches. A batch is sent once it is full or by a timer, so the events of
+    a generator which stalls between its items are not held back.
+    '''
+    def __init__(self, minion_instance):
+        self.minion_instance = minion_instance
+        self.events = []
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def add(self, event):
+        '''
+        Add an event to the batch
+        '''
+        with self.lock:
+            self.events.append(event)
+            if len(self.events) >= _PROG_EVENT_BATCH:
+                self._send()
+            elif self.timer is None:
+                self.timer = threading.Timer(_PROG_EVENT_INTERVAL, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        '''
+        Send the pending events
+        '''
+        with self.lock:
+            self._send()
+
+    def _send(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.events:
+            events, self.events = self.events, []
+            self.minion_instance._fire_master(events=events)
+
+
+# The target types whose matcher is passed the delimiter of the publication
+_DELIMITED_TGT_TYPES = frozenset(('grain', 'grain_pcre', 'pillar'))
+
+# Flags for writing a job's proc file, O_BINARY only exists on Windows
+_PROC_FILE_FLAGS = (os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                    getattr(os, 'O_BINARY', 0) | getattr(os, 'O_CLOEXEC', 0))
+
+
+def _write_proc_file(fn_, data):
+    '''
+    Write the serialized job data to the proc file of a job, bypassing the
+    buffered file object as the data is written in one go. If the proc dir
+    was removed after get_proc_dir cached it, it is created again.
+    '''
+    try:
+        fd_ = os.open(fn_, _PROC_FILE_FLAGS, 0o666)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+        proc_dir = os.path.dirname(fn_)
+        for key, cached in list(_PROC_DIR_CACHE.items()):
+            if cached == proc_dir:
+                del _PROC_DIR_CACHE[key]
+                cachedir, mode, uid, gid = key
+                get_proc_dir(cachedir, mode=mode, uid=uid, gid=gid)
+        fd_ = os.open(fn_, _PROC_FILE_FLAGS, 0o666)
+    try:
+        while data:
+            data = data[os.write(fd_, data):]
+    finally:
+        os.close(fd_)
+
+
+# Proc dirs which have already been created and had their mode and
+# ownership set, keyed by the get_proc_dir arguments
+_PROC_DIR_CACHE = {}
+
+
 def get_proc_dir(cachedir, **kwargs):
     '''
     Given the cache directory, return the directory that process data is
@@ -215,7 +458,14 @@ def get_proc_dir(cachedir, **kwargs):
     gid: the gid to set, if not set, or it is None or -1 no changes are
          made. Same applies if the directory is already owned by this
          gid. Must be int. Works only on unix/unix like systems.
+
+    The directory is only checked on the first call with a given set of
+    arguments, later calls return the cached path.
     '''
+    key = (cachedir, kwargs.get('mode'), kwargs.get('uid', -1), kwargs.get('gid', -1))
+    if key in _PROC_DIR_CACHE:
+        return _PROC_DIR_CACHE[key]
+
     fn_ = os.path.join(cachedir, 'proc')
     mode = kwargs.pop('mode', None)
 
@@ -224,11 +474,14 @@ def get_proc_dir(cachedir, **kwargs):
     else:
         mode = {'mode': mode}
 
-    if not os.path.isdir(fn_):
+    try:
+        d_stat = os.stat(fn_)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
         # proc_dir is not present, create it with mode settings
         os.makedirs(fn_, **mode)
-
-    d_stat = os.stat(fn_)
+        d_stat = os.stat(fn_)
 
     # if mode is not an empty dict then we have an explicit
     # dir mode. So lets check if mode needs to be changed.
@@ -237,17 +490,18 @@ def get_proc_dir(cachedir, **kwargs):
         if mode_part != mode['mode']:
             os.chmod(fn_, (d_stat.st_mode ^ mode_part) | mode['mode'])
 
-    if hasattr(os, 'chown'):
+    if _HAS_CHOWN:
         # only on unix/unix like systems
         uid = kwargs.pop('uid', -1)
         gid = kwargs.pop('gid', -1)
 
-        # if uid and gid are both -1 then go ahead with
-        # no changes at all
-        if (d_stat.st_uid != uid or d_stat.st_gid != gid) and \
-                [i for i in (uid, gid) if i != -1]:
+        # only change the ownership which was asked for and differs, -1
+        # leaves the uid or gid untouched
+        if (uid != -1 and d_stat.st_uid != uid) or \
+                (gid != -1 and d_stat.st_gid != gid):
             os.chown(fn_, uid, gid)
 
+    _PROC_DIR_CACHE[key] = fn_
     return fn_
 
 
@@ -264,74 +518,147 @@ def parse_args_and_kwargs(func, args, data=None):
     return load_args_and_kwargs(func, args, data=data)
 
 
+# Argspecs of loaded functions along with a set of their positional argument
+# names, keyed weakly so that reloaded modules do not keep old functions alive
+_ARGSPEC_CACHE = weakref.WeakKeyDictionary()
+
+
+def _get_argspec(func):
+    '''
+    Return the argspec of ``func`` and a frozenset of its argument names,
+    caching both for functions which can be weakly referenced
+    '''
+    try:
+        return _ARGSPEC_CACHE[func]
+    except KeyError:
+        pass
+    except TypeError:
+        # Not weakly referenceable, do not cache
+        argspec = salt.utils.args.get_function_argspec(func)
+        return argspec, frozenset(argspec.args)
+    argspec = salt.utils.args.get_function_argspec(func)
+    ret = _ARGSPEC_CACHE[func] = (argspec, frozenset(argspec.args))
+    return ret
+
+
 def load_args_and_kwargs(func, args, data=None, ignore_invalid=False):
     '''
     Detect the args and kwargs that need to be passed to a function call, and
     check them against what was passed.
     '''
-    argspec = salt.utils.args.get_function_argspec(func)
+    argspec, argspec_args = _get_argspec(func)
+    accepts_kwargs = bool(argspec.keywords)
+    string_types = six.string_types
+    iteritems = six.iteritems
     _args = []
+    _args_append = _args.append
     _kwargs = {}
-    invalid_kwargs = []
+    # Nearly every call only passes valid kwargs, only create the list of
+    # invalid ones when one shows up
+    invalid_kwargs = None
 
     for arg in args:
-        if isinstance(arg, six.string_types):
-            string_arg, string_kwarg = salt.utils.args.parse_input([arg], condition=False)  # pylint: disable=W0632
-            if string_arg:
-                # Don't append the version that was just derived from parse_cli
-                # above, that would result in a 2nd call to
-                # salt.utils.cli.yamlify_arg(), which could mangle the input.
-                _args.append(arg)
-            elif string_kwarg:
-                salt.utils.warn_until(
-                    'Boron',
-                    'The list of function args and kwargs should be parsed '
-                    'by salt.utils.args.parse_input() before calling '
-                    'salt.minion.load_args_and_kwargs().'
-                )
-                if argspec.keywords or next(six.iterkeys(string_kwarg)) in argspec.args:
-                    # Function supports **kwargs or is a positional argument to
-                    # the function.
-                    _kwargs.update(string_kwarg)
-                else:
-                    # **kwargs not in argspec and parsed argument name not in
-                    # list of positional arguments. This keyword argument is
-                    # invalid.
-                    for key, val in six.iteritems(string_kwarg):
-                        invalid_kwargs.append('{0}={1}'.format(key, val))
+        if isinstance(arg, string_types):
+            # Only check for the key=val form here, positional string args
+            # are passed through as is and never need to be yamlified
+            arg_name, arg_value = salt.utils.args.parse_kwarg(arg)
+            if not arg_name:
+                _args_append(arg)
                 continue
+            salt.utils.warn_until(
+                'Boron',
+                'The list of function args and kwargs should be parsed '
+                'by salt.utils.args.parse_input() before calling '
+                'salt.minion.load_args_and_kwargs().'
+            )
+            kwargs = ((arg_name, salt.utils.args.yamlify_arg(arg_value)),)
 
         # if the arg is a dict with __kwarg__ == True, then its a kwarg
         elif isinstance(arg, dict) and arg.pop('__kwarg__', False) is True:
-            for key, val in six.iteritems(arg):
-                if argspec.keywords or key in argspec.args:
-                    # Function supports **kwargs or is a positional argument to
-                    # the function.
-                    _kwargs[key] = val
-                else:
-                    # **kwargs not in argspec and parsed argument name not in
-                    # list of positional arguments. This keyword argument is
-                    # invalid.
-                    invalid_kwargs.append('{0}={1}'.format(key, val))
-            continue
+            kwargs = iteritems(arg)
 
         else:
-            _args.append(arg)
+            _args_append(arg)
+            continue
+
+        for key, val in kwargs:
+            if accepts_kwargs or key in argspec_args:
+                # Function supports **kwargs or is a positional argument to
+                # the function.
+                _kwargs[key] = val
+            else:
+                # **kwargs not in argspec and parsed argument name not in
+                # list of positional arguments. This keyword argument is
+                # invalid.
+                if invalid_kwargs is None:
+                    invalid_kwargs = []
+                invalid_kwargs.append('{0}={1}'.format(key, val))
 
     if invalid_kwargs and not ignore_invalid:
         salt.utils.invalid_kwargs(invalid_kwargs)
 
-    if argspec.keywords and isinstance(data, dict):
+    if accepts_kwargs and isinstance(data, dict):
         # this function accepts **kwargs, pack in the publish data
-        for key, val in six.iteritems(data):
+        for key, val in iteritems(data):
             _kwargs['__pub_{0}'.format(key)] = val
 
     return _args, _kwargs
 
 
+def _close_channel(channel):
+    '''
+    Close a transport channel, the ZeroMQ channels only provide destroy()
+    '''
+    if hasattr(channel, 'close'):
+        channel.close()
+    elif hasattr(channel, 'destroy'):
+        channel.destroy()
+
+
+def _close_connect_attempt(future):
+    '''
+    Close the pub_channel of a master connection attempt which lost the race
+    to another master, once it is connected
+    '''
+    if future.exception() is None:
+        _close_channel(future.result())
+
+
+def _bucket_prefixes(prefixes):
+    '''
+    Group the (prefix, value) pairs in prefixes by the first character of the
+    prefix, keeping their order, so a string only has to be checked against
+    the prefixes it can start with
+    '''
+    buckets = {}
+    for prefix, value in prefixes:
+        buckets.setdefault(prefix[:1], []).append((prefix, value))
+    return dict((char, tuple(bucket)) for char, bucket in six.iteritems(buckets))
+
+
+class _LazyModules(object):
+    '''
+    Build a loader collection the first time the attribute is read. The result
+    is stored on the instance, so further reads and assignments never reach
+    the descriptor again. Remove the attribute from the instance to rebuild it
+    on the next read.
+    '''
+    def __init__(self, name, load):
+        self.name = name
+        self.load = load
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = self.load(instance)
+        instance.__dict__[self.name] = value
+        return value
+
+
 class MinionBase(object):
     def __init__(self, opts):
         self.opts = opts
+        self._shuffled_masters = None
 
     @staticmethod
     def process_schedule(minion, loop_interval):
@@ -411,7 +738,16 @@ class MinionBase(object):
                     log.info('Got list of available master addresses:'
                              ' {0}'.format(opts['master']))
                     if opts['master_shuffle']:
-                        shuffle(opts['master'])
+                        # shuffle only once and keep that order for later
+                        # evaluations of the same configured list, without
+                        # shuffling it in place
+                        cached = getattr(self, '_shuffled_masters', None)
+                        if cached is not None and cached[0] is opts['master']:
+                            shuffled = cached[1]
+                        else:
+                            shuffled = sample(opts['master'], len(opts['master']))
+                            self._shuffled_masters = (opts['master'], shuffled)
+                        opts['master'] = list(shuffled)
                     opts['auth_tries'] = 0
                 # if opts['master'] is a str and we have never created opts['master_list']
                 elif isinstance(opts['master'], str) and ('master_list' not in opts):
@@ -428,8 +764,10 @@ class MinionBase(object):
                 elif failed:
                     log.info('Removing possibly failed master {0} from list of'
                              ' masters'.format(opts['master']))
-                    # create new list of master with the possibly failed one removed
-                    opts['master'] = [x for x in opts['master_list'] if opts['master'] != x]
+                    # create new list of master with the possibly failed one
+                    # removed, keeping the order of the remaining masters
+                    failed_master = opts['master']
+                    opts['master'] = [x for x in opts['master_list'] if x != failed_master]
 
                 else:
                     msg = ('master_type set to \'failover\' but \'master\' '
@@ -464,27 +802,36 @@ class MinionBase(object):
             # shuffle the masters and then loop through them
             local_masters = copy.copy(opts['master'])
 
-            for master in local_masters:
-                opts['master'] = master
-                opts.update(prep_ip_port(opts))
-                opts.update(resolve_dns(opts))
-                self.opts = opts
-
+            if opts.get('master_parallel_connect', False) and len(local_masters) > 1:
                 # on first run, update self.opts with the whole master list
                 # to enable a minion to re-use old masters if they get fixed
                 if 'master_list' not in opts:
                     opts['master_list'] = local_masters
+                pub_channel = yield self._connect_any_master(opts, local_masters, factory_kwargs)
+                self.opts = opts
+                conn = pub_channel is not None
+            else:
+                for master in local_masters:
+                    opts['master'] = master
+                    _update_changed(opts, prep_ip_port(opts))
+                    _update_changed(opts, (yield resolve_dns_async(opts)))
+                    self.opts = opts
 
-                try:
-                    pub_channel = salt.transport.client.AsyncPubChannel.factory(opts, **factory_kwargs)
-                    yield pub_channel.connect()
-                    conn = True
-                    break
-                except SaltClientError:
-                    msg = ('Master {0} could not be reached, trying '
-                           'next master (if any)'.format(opts['master']))
-                    log.info(msg)
-                    continue
+                    # on first run, update self.opts with the whole master list
+                    # to enable a minion to re-use old masters if they get fixed
+                    if 'master_list' not in opts:
+                        opts['master_list'] = local_masters
+
+                    try:
+                        pub_channel = salt.transport.client.AsyncPubChannel.factory(opts, **factory_kwargs)
+                        yield pub_channel.connect()
+                        conn = True
+                        break
+                    except SaltClientError:
+                        msg = ('Master {0} could not be reached, trying '
+                               'next master (if any)'.format(opts['master']))
+                        log.info(msg)
+                        continue
 
             if not conn:
                 self.connected = False
@@ -493,20 +840,73 @@ class MinionBase(object):
                 log.error(msg)
                 raise SaltClientError(msg)
             else:
+                _dns_confirmed(opts)
                 self.tok = pub_channel.auth.gen_token('salt')
                 self.connected = True
                 raise tornado.gen.Return((opts['master'], pub_channel))
 
         # single master sign in
         else:
-            opts.update(prep_ip_port(opts))
-            opts.update(resolve_dns(opts))
+            _update_changed(opts, prep_ip_port(opts))
+            _update_changed(opts, (yield resolve_dns_async(opts)))
             pub_channel = salt.transport.client.AsyncPubChannel.factory(self.opts, **factory_kwargs)
             yield pub_channel.connect()
+            _dns_confirmed(opts)
             self.tok = pub_channel.auth.gen_token('salt')
             self.connected = True
             raise tornado.gen.Return((opts['master'], pub_channel))
 
+    @tornado.gen.coroutine
+    def _connect_any_master(self, opts, masters, factory_kwargs):
+        '''
+        Connect to all of the given masters at once and return the pub_channel
+        of the first one that accepts the connection, updating opts with its
+        settings. Return None if no master could be reached.
+        '''
+        attempts = []
+        futures = []
+        for master in masters:
+            m_opts = copy.copy(opts)
+            m_opts['master'] = master
+            attempts.append(m_opts)
+            future = self._connect_pub_channel(m_opts, factory_kwargs)
+            # the slower attempts are never waited for, consume their errors
+            future.add_done_callback(lambda f: f.exception())
+            futures.append(future)
+
+        waiter = tornado.gen.WaitIterator(*futures)
+        while not waiter.done():
+            try:
+                pub_channel = yield waiter.next()
+            except SaltClientError:
+                msg = ('Master {0} could not be reached, trying '
+                       'next master (if any)'.format(attempts[waiter.current_index]['master']))
+                log.info(msg)
+                continue
+            # close the channels of the other masters as soon as they are
+            # connected, they would stay registered on the io_loop otherwise
+            for index, future in enumerate(futures):
+                if index != waiter.current_index:
+                    future.add_done_callback(_close_connect_attempt)
+            opts.update(attempts[waiter.current_index])
+            raise tornado.gen.Return(pub_channel)
+        raise tornado.gen.Return(None)
+
+    @tornado.gen.coroutine
+    def _connect_pub_channel(self, opts, factory_kwargs):
+        '''
+        Resolve the master set in opts and return a connected pub_channel to it
+        '''
+        _update_changed(opts, prep_ip_port(opts))
+        _update_changed(opts, (yield resolve_dns_async(opts)))
+        pub_channel = salt.transport.client.AsyncPubChannel.factory(opts, **factory_kwargs)
+        try:
+            yield pub_channel.connect()
+        except Exception:
+            _close_channel(pub_channel)
+            raise
+        raise tornado.gen.Return(pub_channel)
+
 
 class SMinion(MinionBase):
     '''
@@ -515,6 +915,19 @@ class SMinion(MinionBase):
     generate all of the salt minion functions and present them with these
     functions for general use.
     '''
+    states = _LazyModules(
+        'states',
+        lambda self: salt.loader.states(self.opts, self.functions, self.utils)
+    )
+    rend = _LazyModules(
+        'rend',
+        lambda self: salt.loader.render(self.opts, self.functions)
+    )
+    matcher = _LazyModules(
+        'matcher',
+        lambda self: Matcher(self.opts, self.functions)
+    )
+
     def __init__(self, opts):
         # Late setup of the opts grains, so we can log from the grains module
         opts['grains'] = salt.loader.grains(opts)
@@ -546,9 +959,9 @@ class SMinion(MinionBase):
         self.proxy = salt.loader.proxy(self.opts, self.functions, self.returners, None)
         # TODO: remove
         self.function_errors = {}  # Keep the funcs clean
-        self.states = salt.loader.states(self.opts, self.functions, self.utils)
-        self.rend = salt.loader.render(self.opts, self.functions)
-        self.matcher = Matcher(self.opts, self.functions)
+        # states, rend and matcher are (re)built on first access
+        for attr in ('states', 'rend', 'matcher'):
+            self.__dict__.pop(attr, None)
         self.functions['sys.reload_modules'] = self.gen_modules
 
 
@@ -558,6 +971,23 @@ class MasterMinion(object):
     master. What makes this class different is that the pillar is
     omitted, otherwise everything else is loaded cleanly.
     '''
+    returners = _LazyModules(
+        'returners',
+        lambda self: self._load_modules('returners')
+    )
+    states = _LazyModules(
+        'states',
+        lambda self: self._load_modules('states')
+    )
+    rend = _LazyModules(
+        'rend',
+        lambda self: self._load_modules('rend')
+    )
+    matcher = _LazyModules(
+        'matcher',
+        lambda self: self._load_modules('matcher')
+    )
+
     def __init__(
             self,
             opts,
@@ -588,18 +1018,26 @@ class MasterMinion(object):
             utils=self.utils,
             whitelist=self.whitelist,
             initial_load=initial_load)
-        if self.mk_returners:
-            self.returners = salt.loader.returners(self.opts, self.functions)
-        if self.mk_states:
-            self.states = salt.loader.states(self.opts,
-                                             self.functions,
-                                             self.utils)
-        if self.mk_rend:
-            self.rend = salt.loader.render(self.opts, self.functions)
-        if self.mk_matcher:
-            self.matcher = Matcher(self.opts, self.functions)
+        # returners, states, rend and matcher are (re)built on first access
+        for attr in ('returners', 'states', 'rend', 'matcher'):
+            self.__dict__.pop(attr, None)
         self.functions['sys.reload_modules'] = self.gen_modules
 
+    def _load_modules(self, attr):
+        '''
+        Load the requested module collection, unless it was disabled when
+        creating the MasterMinion
+        '''
+        if not getattr(self, 'mk_{0}'.format(attr)):
+            raise AttributeError(attr)
+        if attr == 'returners':
+            return salt.loader.returners(self.opts, self.functions)
+        if attr == 'states':
+            return salt.loader.states(self.opts, self.functions, self.utils)
+        if attr == 'rend':
+            return salt.loader.render(self.opts, self.functions)
+        return Matcher(self.opts, self.functions)
+
 
 class MultiMinion(MinionBase):
     '''
@@ -636,9 +1074,23 @@ class MultiMinion(MinionBase):
             raise SaltException('For multi-master, tcp_(pub/pull)_port '
                                 'settings must be lists of ports, or the '
                                 'default 4510 and 4511')
-        masternumber = 0
-        for master in set(self.opts['master']):
-            s_opts = copy.deepcopy(self.opts)
+        # Every minion gets its own copy of the opts. Serialize them once and
+        # unpickle a copy per master, which is much cheaper than a deepcopy
+        # of the whole opts dict for every master.
+        try:
+            pickled_opts = pickle.dumps(self.opts, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            log.debug('Unable to pickle the minion opts, falling back to deepcopy')
+            pickled_opts = None
+        # Drop duplicate masters but keep the configured order
+        seen = set()
+        masters = [master for master in self.opts['master']
+                   if not (master in seen or seen.add(master))]
+        for masternumber, master in enumerate(masters):
+            if pickled_opts is not None:
+                s_opts = pickle.loads(pickled_opts)
+            else:
+                s_opts = copy.deepcopy(self.opts)
             s_opts['master'] = master
             s_opts['multimaster'] = True
             s_opts['auth_timeout'] = self.MINION_CONNECT_TIMEOUT
@@ -651,14 +1103,12 @@ class MultiMinion(MinionBase):
                     s_opts['tcp_pub_port'] = self.opts['tcp_pub_port'] + (masternumber * 2)
                     s_opts['tcp_pull_port'] = self.opts['tcp_pull_port'] + (masternumber * 2)
             self.io_loop.spawn_callback(self._connect_minion, s_opts)
-            masternumber += 1
 
     @tornado.gen.coroutine
     def _connect_minion(self, opts):
         '''
         Create a minion, and asynchronously connect it to a master
         '''
-        last = 0  # never have we signed in
         auth_wait = opts['acceptance_wait_time']
         while True:
             try:
@@ -701,6 +1151,52 @@ class Minion(MinionBase):
     This class instantiates a minion, runs connections for a minion,
     and loads all of the functions into the minion
     '''
+    # Map the func of a manage_schedule/manage_beacons request to the
+    # Schedule/Beacon method to call and the request data passed as its
+    # arguments
+    _SCHEDULE_FUNCS = {
+        'delete': ('delete_job', ('name', 'persist')),
+        'add': ('add_job', ('schedule', 'persist')),
+        'modify': ('modify_job', ('name', 'schedule', 'persist', 'where')),
+        'enable': ('enable_schedule', ()),
+        'disable': ('disable_schedule', ()),
+        'enable_job': ('enable_job', ('name', 'persist', 'where')),
+        'run_job': ('run_job', ('name',)),
+        'disable_job': ('disable_job', ('name', 'persist', 'where')),
+        'reload': ('reload', ('schedule',)),
+        'list': ('list', ('where',)),
+        'save_schedule': ('save_schedule', ()),
+    }
+    _BEACONS_FUNCS = {
+        'add': ('add_beacon', ('name', 'beacon_data')),
+        'modify': ('modify_beacon', ('name', 'beacon_data')),
+        'delete': ('delete_beacon', ('name',)),
+        'enable': ('enable_beacons', ()),
+        'disable': ('disable_beacons', ()),
+        'enable_beacon': ('enable_beacon', ('name',)),
+        'disable_beacon': ('disable_beacon', ('name',)),
+        'list': ('list_beacons', ()),
+    }
+
+    # Map the tag of a local minion event to the name of the method which
+    # handles it, see handle_event
+    _EVENT_HANDLER_PREFIXES = (
+        ('module_refresh', '_handle_module_refresh_event'),
+        ('pillar_refresh', '_handle_pillar_refresh_event'),
+        ('manage_schedule', 'manage_schedule'),
+        ('manage_beacons', 'manage_beacons'),
+        ('grains_refresh', '_handle_grains_refresh_event'),
+        ('environ_setenv', 'environ_setenv'),
+        ('_minion_mine', '_mine_send'),
+        ('fire_master', '_handle_fire_master_event'),
+        ('__master_disconnected', '_handle_master_disconnected_event'),
+        ('__master_connected', '_handle_master_connected_event'),
+        ('_salt_error', '_handle_salt_error_event'),
+        ('salt/auth/creds', '_handle_auth_creds_event'),
+    )
+    _EVENT_HANDLERS = dict(_EVENT_HANDLER_PREFIXES)
+    _EVENT_HANDLER_BUCKETS = _bucket_prefixes(_EVENT_HANDLER_PREFIXES)
+
     def __init__(self, opts, timeout=60, safe=True, loaded_base_name=None, io_loop=None):  # pylint: disable=W0231
         '''
         Pass in the options dict
@@ -712,6 +1208,10 @@ class Minion(MinionBase):
 
         self._running = None
         self.win_proc = []
+        # publications waiting for a free slot when process_count_max is set
+        self._pending_jobs = collections.deque()
+        self._req_channel = None
+        self._req_channel_owner = (os.getpid(), threading.current_thread().ident)
         self.loaded_base_name = loaded_base_name
         self.restart = False
 
@@ -720,22 +1220,15 @@ class Minion(MinionBase):
             self.io_loop.install()
 
         # Warn if ZMQ < 3.2
-        if HAS_ZMQ:
-            try:
-                zmq_version_info = zmq.zmq_version_info()
-            except AttributeError:
-                # PyZMQ <= 2.1.9 does not have zmq_version_info, fall back to
-                # using zmq.zmq_version() and build a version info tuple.
-                zmq_version_info = tuple(
-                    [int(x) for x in zmq.zmq_version().split('.')]
-                )
-            if zmq_version_info < (3, 2):
-                log.warning(
-                    'You have a version of ZMQ less than ZMQ 3.2! There are '
-                    'known connection keep-alive issues with ZMQ < 3.2 which '
-                    'may result in loss of contact with minions. Please '
-                    'upgrade your ZMQ!'
-                )
+        global _ZMQ_WARNED
+        if ZMQ_TOO_OLD and not _ZMQ_WARNED:
+            _ZMQ_WARNED = True
+            log.warning(
+                'You have a version of ZMQ less than ZMQ 3.2! There are '
+                'known connection keep-alive issues with ZMQ < 3.2 which '
+                'may result in loss of contact with minions. Please '
+                'upgrade your ZMQ!'
+            )
         # Late setup the of the opts grains, so we can log from the grains
         # module.  If this is a proxy, however, we need to init the proxymodule
         # before we can get the grains.  We do this for proxies in the
@@ -836,25 +1329,24 @@ class Minion(MinionBase):
         Based on the minion configuration, either return a randomized timer or
         just return the value of the return_retry_timer.
         '''
-        msg = 'Minion return retry timer set to {0} seconds'
+        msg = 'Minion return retry timer set to %s seconds'
         if self.opts.get('return_retry_timer_max'):
             try:
                 random_retry = randint(self.opts['return_retry_timer'], self.opts['return_retry_timer_max'])
-                log.debug(msg.format(random_retry) + ' (randomized)')
+                log.debug(msg + ' (randomized)', random_retry)
                 return random_retry
             except ValueError:
                 # Catch wiseguys using negative integers here
                 log.error(
-                    'Invalid value (return_retry_timer: {0} or return_retry_timer_max: {1})'
-                    'both must be a positive integers'.format(
-                        self.opts['return_retry_timer'],
-                        self.opts['return_retry_timer_max'],
-                    )
+                    'Invalid value (return_retry_timer: %s or return_retry_timer_max: %s)'
+                    'both must be a positive integers',
+                    self.opts['return_retry_timer'],
+                    self.opts['return_retry_timer_max'],
                 )
-                log.debug(msg.format(DEFAULT_MINION_OPTS['return_retry_timer']))
+                log.debug(msg, DEFAULT_MINION_OPTS['return_retry_timer'])
                 return DEFAULT_MINION_OPTS['return_retry_timer']
         else:
-            log.debug(msg.format(self.opts.get('return_retry_timer')))
+            log.debug(msg, self.opts.get('return_retry_timer'))
             return self.opts.get('return_retry_timer')
 
     def _prep_mod_opts(self):
@@ -875,67 +1367,67 @@ class Minion(MinionBase):
         # Process Beacons
         try:
             beacons = self.process_beacons(self.functions)
-        except Exception as exc:
-            log.critical('Beacon processing failed: {0}. No beacons will be processed.'.format(traceback.format_exc(exc)))
+        except Exception:
+            log.critical('Beacon processing failed. No beacons will be processed.', exc_info=True)
             beacons = None
         if beacons:
             self._fire_master(events=beacons)
+            # Every event has to be published as a message of its own, local
+            # subscribers unpack exactly one tag and payload per message
+            max_event_size = self.opts.get('max_event_size', 1048576)
+            tagend = salt.utils.event.TAGEND
+            handle_publish = self.event_publisher.handle_publish
             for beacon in beacons:
                 serialized_data = salt.utils.dicttrim.trim_dict(
                     self.serial.dumps(beacon['data']),
-                    self.opts.get('max_event_size', 1048576),
+                    max_event_size,
                     is_msgpacked=True,
                 )
-                log.debug('Sending event - data = {0}'.format(beacon['data']))
-                event = '{0}{1}{2}'.format(
-                        beacon['tag'],
-                        salt.utils.event.TAGEND,
-                        serialized_data,
+                log.debug('Sending event - data = %s', beacon['data'])
+                handle_publish(
+                    ['{0}{1}{2}'.format(beacon['tag'], tagend, serialized_data)]
                 )
-                self.event_publisher.handle_publish([event])
 
     def _load_modules(self, force_refresh=False, notify=False, proxy=None):
         '''
         Return the functions and the returners loaded up from the loader
         module
         '''
-        # if this is a *nix system AND modules_max_memory is set, lets enforce
-        # a memory limit on module imports
-        # this feature ONLY works on *nix like OSs (resource module doesn't work on windows)
-        modules_max_memory = False
-        if self.opts.get('modules_max_memory', -1) > 0 and HAS_PSUTIL and HAS_RESOURCE:
-            log.debug('modules_max_memory set, enforcing a maximum of {0}'.format(self.opts['modules_max_memory']))
-            modules_max_memory = True
-            old_mem_limit = resource.getrlimit(resource.RLIMIT_AS)
-            rss, vms = psutil.Process(os.getpid()).memory_info()
-            mem_limit = rss + vms + self.opts['modules_max_memory']
-            resource.setrlimit(resource.RLIMIT_AS, (mem_limit, mem_limit))
-        elif self.opts.get('modules_max_memory', -1) > 0:
-            if not HAS_PSUTIL:
-                log.error('Unable to enforce modules_max_memory because psutil is missing')
-            if not HAS_RESOURCE:
-                log.error('Unable to enforce modules_max_memory because resource is missing')
-
-        self.opts['grains'] = salt.loader.grains(self.opts, force_refresh)
-        self.utils = salt.loader.utils(self.opts)
-        if self.opts.get('multimaster', False):
-            s_opts = copy.deepcopy(self.opts)
-            functions = salt.loader.minion_mods(s_opts, utils=self.utils, proxy=proxy,
-                                                loaded_base_name=self.loaded_base_name, notify=notify)
-        else:
-            functions = salt.loader.minion_mods(self.opts, utils=self.utils, notify=notify, proxy=proxy)
-        returners = salt.loader.returners(self.opts, functions)
-        errors = {}
-        if '_errors' in functions:
-            errors = functions['_errors']
-            functions.pop('_errors')
-
-        # we're done, reset the limits!
-        if modules_max_memory is True:
-            resource.setrlimit(resource.RLIMIT_AS, old_mem_limit)
+        with _modules_max_memory(self.opts):
+            self.opts['grains'] = salt.loader.grains(self.opts, force_refresh)
+            self.utils = salt.loader.utils(self.opts)
+            if self.opts.get('multimaster', False):
+                # every master already has its own copy of the opts and the
+                # loader only keeps a shallow copy of them, so no need to copy
+                functions = salt.loader.minion_mods(self.opts, utils=self.utils, proxy=proxy,
+                                                    loaded_base_name=self.loaded_base_name, notify=notify)
+            else:
+                functions = salt.loader.minion_mods(self.opts, utils=self.utils, notify=notify, proxy=proxy)
+            returners = salt.loader.returners(self.opts, functions)
+            errors = {}
+            if '_errors' in functions:
+                errors = functions['_errors']
+                functions.pop('_errors')
 
         return functions, returners, errors
 
+    def _get_req_channel(self):
+        '''
+        Return a request channel to the master. Calls from the process and
+        thread which created the minion reuse one channel per master_uri, job
+        threads and forked job processes get a new channel on every call.
+        '''
+        owner = getattr(self, '_req_channel_owner', None)
+        if owner != (os.getpid(), threading.current_thread().ident):
+            return salt.transport.Channel.factory(self.opts)
+        master_uri = self.opts.get('master_uri')
+        if self._req_channel is None or self._req_channel[0] != master_uri:
+            if self._req_channel is not None:
+                _close_channel(self._req_channel[1])
+            self._req_channel = (master_uri,
+                                 salt.transport.Channel.factory(self.opts))
+        return self._req_channel[1]
+
     def _fire_master(self, data=None, tag=None, events=None, pretag=None, timeout=60):
         '''
         Fire an event on the master, or drop message if unable to send.
@@ -954,7 +1446,7 @@ class Minion(MinionBase):
             load['tag'] = tag
         else:
             return
-        channel = salt.transport.Channel.factory(self.opts)
+        channel = self._get_req_channel()
         try:
             result = channel.send(load, timeout=timeout)
             return True
@@ -962,7 +1454,7 @@ class Minion(MinionBase):
             log.info('fire_master failed: master could not be contacted. Request timed out.')
             return False
         except Exception:
-            log.info('fire_master failed: {0}'.format(traceback.format_exc()))
+            log.info('fire_master failed: %s', traceback.format_exc())
             return False
 
     def _handle_decoded_payload(self, data):
@@ -972,20 +1464,57 @@ class Minion(MinionBase):
         '''
         if 'user' in data:
             log.info(
-                'User {0[user]} Executing command {0[fun]} with jid '
-                '{0[jid]}'.format(data)
+                'User %s Executing command %s with jid %s',
+                data['user'], data['fun'], data['jid']
             )
         else:
             log.info(
-                'Executing command {0[fun]} with jid {0[jid]}'.format(data)
+                'Executing command %s with jid %s', data['fun'], data['jid']
             )
-        log.debug('Command details {0}'.format(data))
+        log.debug('Command details %s', data)
 
         if isinstance(data['fun'], six.string_types):
             if data['fun'] == 'sys.reload_modules':
                 self.functions, self.returners, self.function_errors = self._load_modules()
                 self.schedule.functions = self.functions
                 self.schedule.returners = self.returners
+
+        # Queue the job until a slot is free if the amount of concurrently
+        # running jobs is limited. Jobs which are already waiting go first.
+        process_count_max = self.opts.get('process_count_max', -1)
+        if process_count_max > 0:
+            if self._pending_jobs or \
+                    len(salt.utils.minion.running(self.opts)) >= process_count_max:
+                log.warning('Maximum number of processes reached while '
+                            'executing jid %s, waiting...', data['jid'])
+                self._pending_jobs.append(data)
+                if len(self._pending_jobs) == 1:
+                    self.io_loop.spawn_callback(self._spawn_pending_jobs)
+                return
+
+        self._spawn_job(data)
+
+    @tornado.gen.coroutine
+    def _spawn_pending_jobs(self):
+        '''
+        Spawn the queued jobs in the order they were published as soon as
+        process_count_max allows it
+        '''
+        while self._pending_jobs:
+            yield tornado.gen.sleep(_PROCESS_COUNT_INTERVAL)
+            free = self.opts['process_count_max'] - len(salt.utils.minion.running(self.opts))
+            while free > 0 and self._pending_jobs:
+                data = self._pending_jobs.popleft()
+                try:
+                    self._spawn_job(data)
+                except Exception:
+                    log.exception('Failed to start the job with jid %s', data['jid'])
+                free -= 1
+
+    def _spawn_job(self, data):
+        '''
+        Start the process or thread which runs the job in data
+        '''
         if isinstance(data['fun'], tuple) or isinstance(data['fun'], list):
             target = Minion._thread_multi_return
         else:
@@ -1010,10 +1539,14 @@ class Minion(MinionBase):
                 name=data['jid']
             )
         process.start()
-        if not sys.platform.startswith('win'):
-            process.join()
-        else:
+        if sys.platform.startswith('win'):
             self.win_proc.append(process)
+        elif self.opts['multiprocessing']:
+            # The job process daemonizes right away, this only reaps the
+            # intermediate child and does not wait for the job. Job threads
+            # are not joined, that would block the IO loop until the job is
+            # done.
+            process.join()
 
     @classmethod
     def _thread_return(cls, minion_instance, opts, data):
@@ -1055,9 +1588,8 @@ class Minion(MinionBase):
 
         sdata = {'pid': os.getpid()}
         sdata.update(data)
-        log.info('Starting a new job with PID {0}'.format(sdata['pid']))
-        with salt.utils.fopen(fn_, 'w+b') as fp_:
-            fp_.write(minion_instance.serial.dumps(sdata))
+        log.info('Starting a new job with PID %s', sdata['pid'])
+        _write_proc_file(fn_, minion_instance.serial.dumps(sdata))
         ret = {'success': False}
         function_name = data['fun']
         if function_name in minion_instance.functions:
@@ -1081,17 +1613,24 @@ class Minion(MinionBase):
                 if isinstance(return_data, types.GeneratorType):
                     ind = 0
                     iret = {}
-                    for single in return_data:
-                        if isinstance(single, dict) and isinstance(iret, dict):
-                            iret.update(single)
-                        else:
-                            if not iret:
-                                iret = []
-                            iret.append(single)
-                        tag = tagify([data['jid'], 'prog', opts['id'], str(ind)], 'job')
-                        event_data = {'return': single}
-                        minion_instance._fire_master(event_data, tag)
-                        ind += 1
+                    events = _ProgEventBatch(minion_instance)
+                    try:
+                        for single in return_data:
+                            if isinstance(single, dict) and isinstance(iret, dict):
+                                iret.update(single)
+                            else:
+                                if not iret:
+                                    iret = []
+                                iret.append(single)
+                            tag = tagify([data['jid'], 'prog', opts['id'], str(ind)], 'job')
+                            events.add({'id': opts['id'],
+                                        'cmd': '_minion_event',
+                                        'data': {'return': single},
+                                        'tag': tag})
+                            ind += 1
+                    finally:
+                        # send what is left, also when the generator failed
+                        events.flush()
                     ret['return'] = iret
                 else:
                     ret['return'] = return_data
@@ -1109,20 +1648,14 @@ class Minion(MinionBase):
                 ret['out'] = 'nested'
             except CommandExecutionError as exc:
                 log.error(
-                    'A command in {0!r} had a problem: {1}'.format(
-                        function_name,
-                        exc
-                    ),
+                    'A command in %r had a problem: %s', function_name, exc,
                     exc_info_on_loglevel=logging.DEBUG
                 )
                 ret['return'] = 'ERROR: {0}'.format(exc)
                 ret['out'] = 'nested'
             except SaltInvocationError as exc:
                 log.error(
-                    'Problem executing {0!r}: {1}'.format(
-                        function_name,
-                        exc
-                    ),
+                    'Problem executing %r: %s', function_name, exc,
                     exc_info_on_loglevel=logging.DEBUG
                 )
                 ret['return'] = 'ERROR executing {0!r}: {1}'.format(
@@ -1164,22 +1697,7 @@ class Minion(MinionBase):
             timeout=minion_instance._return_retry_timer()
         )
         if data['ret']:
-            if 'ret_config' in data:
-                ret['ret_config'] = data['ret_config']
-            ret['id'] = opts['id']
-            for returner in set(data['ret'].split(',')):
-                try:
-                    minion_instance.returners['{0}.returner'.format(
-                        returner
-                    )](ret)
-                except Exception as exc:
-                    log.error(
-                        'The return failed for job {0} {1}'.format(
-                        data['jid'],
-                        exc
-                        )
-                    )
-                    log.error(traceback.format_exc())
+            minion_instance._dispatch_returners(ret, data)
 
     @classmethod
     def _thread_multi_return(cls, minion_instance, opts, data):
@@ -1216,9 +1734,7 @@ class Minion(MinionBase):
             except Exception as exc:
                 trb = traceback.format_exc()
                 log.warning(
-                    'The minion function caused an exception: {0}'.format(
-                        exc
-                    )
+                    'The minion function caused an exception: %s', exc
                 )
                 ret['return'][data['fun'][ind]] = trb
             ret['jid'] = data['jid']
@@ -1231,38 +1747,43 @@ class Minion(MinionBase):
             timeout=minion_instance._return_retry_timer()
         )
         if data['ret']:
-            if 'ret_config' in data:
-                ret['ret_config'] = data['ret_config']
-            for returner in set(data['ret'].split(',')):
-                ret['id'] = opts['id']
-                try:
-                    minion_instance.returners['{0}.returner'.format(
-                        returner
-                    )](ret)
-                except Exception as exc:
-                    log.error(
-                        'The return failed for job {0} {1}'.format(
-                        data['jid'],
-                        exc
-                        )
-                    )
+            minion_instance._dispatch_returners(ret, data)
 
-    def _return_pub(self, ret, ret_cmd='_return', timeout=60):
+    def _dispatch_returners(self, ret, data):
         '''
-        Return the data from the executed command to the master server
+        Send the return of a job to the returners named in its ``ret`` option
+        '''
+        if 'ret_config' in data:
+            ret['ret_config'] = data['ret_config']
+        ret['id'] = self.opts['id']
+        returners = data['ret']
+        if isinstance(returners, six.string_types):
+            returners = returners.split(',')
+        # skip empty names, e.g. from a trailing comma
+        for returner in set(filter(None, returners)):
+            try:
+                self.returners['{0}.returner'.format(returner)](ret)
+            except Exception as exc:
+                log.error(
+                    'The return failed for job %s %s', data['jid'], exc
+                )
+                log.error(traceback.format_exc())
+
+    def _prepare_return(self, ret, ret_cmd='_return'):
+        '''
+        Build the load which returns the data of an executed command to the
+        master server
         '''
         jid = ret.get('jid', ret.get('__jid__'))
         fun = ret.get('fun', ret.get('__fun__'))
         if self.opts['multiprocessing']:
             fn_ = os.path.join(self.proc_dir, jid)
-            if os.path.isfile(fn_):
-                try:
-                    os.remove(fn_)
-                except (OSError, IOError):
-                    # The file is gone already
-                    pass
-        log.info('Returning information for job: {0}'.format(jid))
-        channel = salt.transport.Channel.factory(self.opts)
+            try:
+                os.remove(fn_)
+            except (OSError, IOError):
+                # The file is gone already
+                pass
+        log.info('Returning information for job: %s', jid)
         if ret_cmd == '_syndic_return':
             load = {'cmd': ret_cmd,
                     'id': self.opts['id'],
@@ -1274,23 +1795,21 @@ class Minion(MinionBase):
                     'load': ret.get('__load__')}
             if '__master_id__' in ret:
                 load['master_id'] = ret['__master_id__']
-            load['return'] = {}
-            for key, value in six.iteritems(ret):
-                if key.startswith('__'):
-                    continue
-                load['return'][key] = value
+            load['return'] = dict(
+                (key, value) for key, value in six.iteritems(ret)
+                if not key.startswith('__')
+            )
         else:
             load = {'cmd': ret_cmd,
                     'id': self.opts['id']}
-            for key, value in six.iteritems(ret):
-                load[key] = value
+            load.update(ret)
 
         if 'out' in ret:
             if isinstance(ret['out'], six.string_types):
                 load['out'] = ret['out']
             else:
-                log.error('Invalid outputter {0}. This is likely a bug.'
-                          .format(ret['out']))
+                log.error('Invalid outputter %s. This is likely a bug.',
+                          ret['out'])
         else:
             try:
                 oput = self.functions[fun].__outputter__
@@ -1302,20 +1821,45 @@ class Minion(MinionBase):
         if self.opts['cache_jobs']:
             # Local job cache has been enabled
             salt.utils.minion.cache_jobs(self.opts, load['jid'], ret)
+        return load
 
+    def _send_return(self, load, jids, timeout=60):
+        '''
+        Send a return load for the given jids to the master server
+        '''
+        channel = self._get_req_channel()
         try:
             ret_val = channel.send(load, timeout=timeout)
         except SaltReqTimeoutError:
             msg = ('The minion failed to return the job information for job '
                    '{0}. This is often due to the master being shut down or '
                    'overloaded. If the master is running consider increasing '
-                   'the worker_threads value.').format(jid)
+                   'the worker_threads value.').format(', '.join(jids))
             log.warn(msg)
             return ''
 
-        log.trace('ret_val = {0}'.format(ret_val))
+        log.trace('ret_val = %s', ret_val)
         return ret_val
 
+    def _return_pub(self, ret, ret_cmd='_return', timeout=60):
+        '''
+        Return the data from the executed command to the master server
+        '''
+        load = self._prepare_return(ret, ret_cmd)
+        return self._send_return(load, [load['jid']], timeout=timeout)
+
+    def _return_pub_multi(self, rets, ret_cmd='_syndic_return', timeout=60):
+        '''
+        Return the data of several executed commands to the master server in
+        a single request. The master only accepts a list of loads for
+        _syndic_return.
+        '''
+        loads = [self._prepare_return(ret, ret_cmd) for ret in rets]
+        load = {'cmd': ret_cmd,
+                'id': self.opts['id'],
+                'load': loads}
+        return self._send_return(load, [item['jid'] for item in loads], timeout=timeout)
+
     def _state_run(self):
         '''
         Execute a state run based on information set in the minion config file
@@ -1352,28 +1896,27 @@ class Minion(MinionBase):
             })
 
     def _fire_master_minion_start(self):
-        # Send an event to the master that the minion is live
-        self._fire_master(
-            'Minion {0} started at {1}'.format(
+        # Send an event to the master that the minion is live, along with
+        # the dup name spaced event, in a single request. The master fires
+        # each entry of events as is, so carry over the fields it would have
+        # put on a single tagged event.
+        data = 'Minion {0} started at {1}'.format(
             self.opts['id'],
             time.asctime()
-            ),
-            'minion_start'
-        )
-        # dup name spaced event
-        self._fire_master(
-            'Minion {0} started at {1}'.format(
-            self.opts['id'],
-            time.asctime()
-            ),
-            tagify([self.opts['id'], 'start'], 'minion'),
         )
+        events = []
+        for tag in ('minion_start', tagify([self.opts['id'], 'start'], 'minion')):
+            events.append({'id': self.opts['id'],
+                           'cmd': '_minion_event',
+                           'data': data,
+                           'tag': tag})
+        self._fire_master(events=events)
 
     def module_refresh(self, force_refresh=False, notify=False):
         '''
         Refresh the functions and returners.
         '''
-        log.debug('Refreshing modules. Notify={0}'.format(notify))
+        log.debug('Refreshing modules. Notify=%s', notify)
         if hasattr(self, 'proxy'):
             self.functions, self.returners, _ = self._load_modules(force_refresh, notify=notify, proxy=self.proxy)
 
@@ -1415,68 +1958,30 @@ class Minion(MinionBase):
         '''
         Refresh the functions and returners.
         '''
-        tag, data = salt.utils.event.MinionEvent.unpack(package)
-        func = data.get('func', None)
-        name = data.get('name', None)
-        schedule = data.get('schedule', None)
-        where = data.get('where', None)
-        persist = data.get('persist', None)
-
-        if func == 'delete':
-            self.schedule.delete_job(name, persist)
-        elif func == 'add':
-            self.schedule.add_job(schedule, persist)
-        elif func == 'modify':
-            self.schedule.modify_job(name, schedule, persist, where)
-        elif func == 'enable':
-            self.schedule.enable_schedule()
-        elif func == 'disable':
-            self.schedule.disable_schedule()
-        elif func == 'enable_job':
-            self.schedule.enable_job(name, persist, where)
-        elif func == 'run_job':
-            self.schedule.run_job(name)
-        elif func == 'disable_job':
-            self.schedule.disable_job(name, persist, where)
-        elif func == 'reload':
-            self.schedule.reload(schedule)
-        elif func == 'list':
-            self.schedule.list(where)
-        elif func == 'save_schedule':
-            self.schedule.save_schedule()
+        tag, data = salt.utils.event.MinionEvent.unpack(package, self.serial)
+        try:
+            method, args = self._SCHEDULE_FUNCS[data.get('func')]
+        except KeyError:
+            return
+        getattr(self.schedule, method)(*[data.get(arg) for arg in args])
 
     def manage_beacons(self, package):
         '''
         Manage Beacons
         '''
-        tag, data = salt.utils.event.MinionEvent.unpack(package)
-        func = data.get('func', None)
-        name = data.get('name', None)
-        beacon_data = data.get('beacon_data', None)
-
-        if func == 'add':
-            self.beacons.add_beacon(name, beacon_data)
-        elif func == 'modify':
-            self.beacons.modify_beacon(name, beacon_data)
-        elif func == 'delete':
-            self.beacons.delete_beacon(name)
-        elif func == 'enable':
-            self.beacons.enable_beacons()
-        elif func == 'disable':
-            self.beacons.disable_beacons()
-        elif func == 'enable_beacon':
-            self.beacons.enable_beacon(name)
-        elif func == 'disable_beacon':
-            self.beacons.disable_beacon(name)
-        elif func == 'list':
-            self.beacons.list_beacons()
+        tag, data = salt.utils.event.MinionEvent.unpack(package, self.serial)
+        try:
+            method, args = self._BEACONS_FUNCS[data.get('func')]
+        except KeyError:
+            return
+        getattr(self.beacons, method)(*[data.get(arg) for arg in args])
 
     def environ_setenv(self, package):
         '''
         Set the salt-minion main process environment according to
         the data contained in the minion event data
         '''
-        tag, data = salt.utils.event.MinionEvent.unpack(package)
+        tag, data = salt.utils.event.MinionEvent.unpack(package, self.serial)
         environ = data.get('environ', None)
         if environ is None:
             return False
@@ -1535,8 +2040,8 @@ class Minion(MinionBase):
         '''
         Send mine data to the master
         '''
-        channel = salt.transport.Channel.factory(self.opts)
-        load = salt.utils.event.SaltEvent.unpack(package)[1]
+        channel = self._get_req_channel()
+        load = salt.utils.event.SaltEvent.unpack(package, self.serial)[1]
         load['tok'] = self.tok
         try:
             ret = channel.send(load)
@@ -1545,127 +2050,133 @@ class Minion(MinionBase):
             log.warning('Unable to send mine data to master.')
             return None
 
-    @tornado.gen.coroutine
-    def handle_event(self, package):
+    def _handle_module_refresh_event(self, package):
+        tag, data = salt.utils.event.MinionEvent.unpack(package, self.serial)
+        self.module_refresh(notify=data.get('notify', False))
+
+    def _handle_pillar_refresh_event(self, package):
+        return self.pillar_refresh()
+
+    def _handle_grains_refresh_event(self, package):
+        if self.grains_cache != self.opts['grains']:
+            self.pillar_refresh(force_refresh=True)
+            self.grains_cache = self.opts['grains']
+
+    def _handle_fire_master_event(self, package):
+        tag, data = salt.utils.event.MinionEvent.unpack(package, self.serial)
+        log.debug('Forwarding master event tag=%s', data['tag'])
+        self._fire_master(data['data'], data['tag'], data['events'], data['pretag'])
+
+    def _master_alive_schedule(self, connected):
         '''
-        Handle an event from the epull_sock (all local minion events)
+        Return the __master_alive job checking the connection to the current
+        master. The scheduler keeps the dict it is given, so build a new one
+        every time.
         '''
-        log.debug('Handling event {0!r}'.format(package))
-        if package.startswith('module_refresh'):
-            tag, data = salt.utils.event.MinionEvent.unpack(package)
-            self.module_refresh(notify=data.get('notify', False))
-        elif package.startswith('pillar_refresh'):
-            yield self.pillar_refresh()
-        elif package.startswith('manage_schedule'):
-            self.manage_schedule(package)
-        elif package.startswith('manage_beacons'):
-            self.manage_beacons(package)
-        elif package.startswith('grains_refresh'):
-            if self.grains_cache != self.opts['grains']:
-                self.pillar_refresh(force_refresh=True)
-                self.grains_cache = self.opts['grains']
-        elif package.startswith('environ_setenv'):
-            self.environ_setenv(package)
-        elif package.startswith('_minion_mine'):
-            self._mine_send(package)
-        elif package.startswith('fire_master'):
-            tag, data = salt.utils.event.MinionEvent.unpack(package)
-            log.debug('Forwarding master event tag={tag}'.format(tag=data['tag']))
-            self._fire_master(data['data'], data['tag'], data['events'], data['pretag'])
-        elif package.startswith('__master_disconnected'):
-            tag, data = salt.utils.event.MinionEvent.unpack(package)
-            # if the master disconnect event is for a different master, raise an exception
-            if data['master'] != self.opts['master']:
-                raise Exception()
-            if self.connected:
-                # we are not connected anymore
-                self.connected = False
-                # modify the scheduled job to fire only on reconnect
-                schedule = {
-                   'function': 'status.master',
-                   'seconds': self.opts['master_alive_interval'],
-                   'jid_include': True,
-                   'maxrunning': 2,
-                   'kwargs': {'master': self.opts['master'],
-                              'connected': False}
-                }
-                self.schedule.modify_job(name='__master_alive',
-                                         schedule=schedule)
+        return {'function': 'status.master',
+                'seconds': self.opts['master_alive_interval'],
+                'jid_include': True,
+                'maxrunning': 2,
+                'kwargs': {'master': self.opts['master'],
+                           'connected': connected}}
 
-                log.info('Connection to master {0} lost'.format(self.opts['master']))
+    @tornado.gen.coroutine
+    def _handle_master_disconnected_event(self, package):
+        tag, data = salt.utils.event.MinionEvent.unpack(package, self.serial)
+        # if the master disconnect event is for a different master, raise an exception
+        if data['master'] != self.opts['master']:
+            raise Exception()
+        if self.connected:
+            # we are not connected anymore
+            self.connected = False
+            # modify the scheduled job to fire only on reconnect
+            self.schedule.modify_job(name='__master_alive',
+                                     schedule=self._master_alive_schedule(False))
+
+            log.info('Connection to master %s lost', self.opts['master'])
+
+            if self.opts['master_type'] == 'failover':
+                log.info('Trying to tune in to next master from master-list')
+
+                if hasattr(self, 'pub_channel'):
+                    self.pub_channel.on_recv(None)
+                    if hasattr(self.pub_channel, 'close'):
+                        self.pub_channel.close()
+                    del self.pub_channel
+
+                # if eval_master finds a new master for us, self.connected
+                # will be True again on successful master authentication
+                try:
+                    master, self.pub_channel = yield self.eval_master(
+                                                        opts=self.opts,
+                                                        failed=True)
+                except SaltClientError:
+                    pass
 
-                if self.opts['master_type'] == 'failover':
-                    log.info('Trying to tune in to next master from master-list')
+                if self.connected:
+                    self.opts['master'] = master
 
-                    if hasattr(self, 'pub_channel'):
-                        self.pub_channel.on_recv(None)
-                        if hasattr(self.pub_channel, 'close'):
-                            self.pub_channel.close()
-                        del self.pub_channel
+                    # re-init the subsystems to work with the new master
+                    log.info('Re-initialising subsystems for new '
+                             'master %s', self.opts['master'])
+                    self.functions, self.returners, self.function_errors = self._load_modules()
+                    self.pub_channel.on_recv(self._handle_payload)
+                    self._fire_master_minion_start()
+                    log.info('Minion is ready to receive requests!')
 
-                    # if eval_master finds a new master for us, self.connected
-                    # will be True again on successful master authentication
-                    try:
-                        master, self.pub_channel = yield self.eval_master(
-                                                            opts=self.opts,
-                                                            failed=True)
-                    except SaltClientError:
-                        pass
-
-                    if self.connected:
-                        self.opts['master'] = master
-
-                        # re-init the subsystems to work with the new master
-                        log.info('Re-initialising subsystems for new '
-                                 'master {0}'.format(self.opts['master']))
-                        self.functions, self.returners, self.function_errors = self._load_modules()
-                        self.pub_channel.on_recv(self._handle_payload)
-                        self._fire_master_minion_start()
-                        log.info('Minion is ready to receive requests!')
-
-                        # update scheduled job to run with the new master addr
-                        schedule = {
-                           'function': 'status.master',
-                           'seconds': self.opts['master_alive_interval'],
-                           'jid_include': True,
-                           'maxrunning': 2,
-                           'kwargs': {'master': self.opts['master'],
-                                      'connected': True}
-                        }
-                        self.schedule.modify_job(name='__master_alive',
-                                                 schedule=schedule)
-                    else:
-                        self.restart = True
-                        self.io_loop.stop()
-
-        elif package.startswith('__master_connected'):
-            # handle this event only once. otherwise it will pollute the log
-            if not self.connected:
-                log.info('Connection to master {0} re-established'.format(self.opts['master']))
-                self.connected = True
-                # modify the __master_alive job to only fire,
-                # if the connection is lost again
-                schedule = {
-                   'function': 'status.master',
-                   'seconds': self.opts['master_alive_interval'],
-                   'jid_include': True,
-                   'maxrunning': 2,
-                   'kwargs': {'master': self.opts['master'],
-                              'connected': True}
-                }
+                    # update scheduled job to run with the new master addr
+                    self.schedule.modify_job(name='__master_alive',
+                                             schedule=self._master_alive_schedule(True))
+                else:
+                    self.restart = True
+                    self.io_loop.stop()
 
-                self.schedule.modify_job(name='__master_alive',
-                                         schedule=schedule)
-        elif package.startswith('_salt_error'):
-            tag, data = salt.utils.event.MinionEvent.unpack(package)
-            log.debug('Forwarding salt error event tag={tag}'.format(tag=tag))
-            self._fire_master(data, tag)
-        elif package.startswith('salt/auth/creds'):
-            tag, data = salt.utils.event.MinionEvent.unpack(package)
-            key = tuple(data['key'])
-            log.debug('Updating auth data for {0}: {1} -> {2}'.format(
-                    key, salt.crypt.AsyncAuth.creds_map.get(key), data['creds']))
-            salt.crypt.AsyncAuth.creds_map[tuple(data['key'])] = data['creds']
+    def _handle_master_connected_event(self, package):
+        # handle this event only once. otherwise it will pollute the log
+        if not self.connected:
+            log.info('Connection to master %s re-established', self.opts['master'])
+            self.connected = True
+            # modify the __master_alive job to only fire,
+            # if the connection is lost again
+            self.schedule.modify_job(name='__master_alive',
+                                     schedule=self._master_alive_schedule(True))
+
+    def _handle_salt_error_event(self, package):
+        tag, data = salt.utils.event.MinionEvent.unpack(package, self.serial)
+        log.debug('Forwarding salt error event tag=%s', tag)
+        self._fire_master(data, tag)
+
+    def _handle_auth_creds_event(self, package):
+        tag, data = salt.utils.event.MinionEvent.unpack(package, self.serial)
+        key = tuple(data['key'])
+        log.debug('Updating auth data for %s: %s -> %s',
+                  key, salt.crypt.AsyncAuth.creds_map.get(key), data['creds'])
+        salt.crypt.AsyncAuth.creds_map[key] = data['creds']
+
+    def handle_event(self, package):
+        '''
+        Handle an event from the epull_sock (all local minion events)
+
+        Most handlers are synchronous and run right away, the future of the
+        ones which are coroutines is returned for the IO loop to finish.
+        '''
+        log.debug('Handling event %r', package)
+        name = self._EVENT_HANDLERS.get(
+            package.partition(salt.utils.event.TAGEND)[0]
+        )
+        if name is None:
+            # the tag is not one of ours as is, the handlers also take
+            # events whose tag only starts with a known one
+            for prefix, handler in self._EVENT_HANDLER_BUCKETS.get(package[:1], ()):
+                if package.startswith(prefix):
+                    name = handler
+                    break
+            else:
+                return None
+        ret = getattr(self, name)(package)
+        if tornado.concurrent.is_future(ret):
+            return ret
+        return None
 
     def _fallback_cleanups(self):
         '''
@@ -1677,14 +2188,40 @@ class Minion(MinionBase):
         # Cleanup Windows threads
         if not salt.utils.is_windows():
             return
+        alive = []
         for thread in self.win_proc:
-            if not thread.is_alive():
+            if thread.is_alive():
+                alive.append(thread)
+            else:
                 thread.join()
-                try:
-                    self.win_proc.remove(thread)
-                    del thread
-                except (ValueError, NameError):
-                    pass
+        self.win_proc = alive
+
+    def _ping_master(self):
+        '''
+        Periodically let the master know the minion is alive
+        '''
+        try:
+            self._fire_master('ping', 'minion_ping')
+        except Exception:
+            log.warning('Attempt to ping master failed.', exc_info_on_loglevel=logging.DEBUG)
+
+    def _handle_beacons(self):
+        '''
+        Periodically process the beacons and send their events to the master
+        '''
+        beacons = None
+        try:
+            beacons = self.process_beacons(self.functions)
+        except Exception:
+            log.critical('The beacon errored: ', exc_info=True)
+        if beacons:
+            self._fire_master(events=beacons)
+
+    def _handle_schedule(self):
+        '''
+        Periodically run the scheduled jobs which are due
+        '''
+        self.process_schedule(self, self.opts['loop_interval'])
 
     # Main Minion Tune In
     def tune_in(self, start=True):
@@ -1722,59 +2259,42 @@ class Minion(MinionBase):
         self._state_run()
 
         loop_interval = self.opts['loop_interval']
+        grains_refresh_every = self.opts['grains_refresh_every']
 
         try:
-            if self.opts['grains_refresh_every']:  # If exists and is not zero. In minutes, not seconds!
-                if self.opts['grains_refresh_every'] > 1:
+            if grains_refresh_every:  # If exists and is not zero. In minutes, not seconds!
+                if grains_refresh_every > 1:
                     log.debug(
-                        'Enabling the grains refresher. Will run every {0} minutes.'.format(
-                            self.opts['grains_refresh_every'])
+                        'Enabling the grains refresher. Will run every %s minutes.',
+                        grains_refresh_every
                     )
                 else:  # Clean up minute vs. minutes in log message
                     log.debug(
-                        'Enabling the grains refresher. Will run every {0} minute.'.format(
-                            self.opts['grains_refresh_every'])
-
+                        'Enabling the grains refresher. Will run every %s minute.',
+                        grains_refresh_every
                     )
                 self._refresh_grains_watcher(
-                    abs(self.opts['grains_refresh_every'])
+                    abs(grains_refresh_every)
                 )
         except Exception as exc:
             log.error(
-                'Exception occurred in attempt to initialize grain refresh routine during minion tune-in: {0}'.format(
-                    exc)
+                'Exception occurred in attempt to initialize grain refresh routine during minion tune-in: %s',
+                exc
             )
 
         self.periodic_callbacks = {}
         # schedule the stuff that runs every interval
         ping_interval = self.opts.get('ping_interval', 0) * 60
         if ping_interval > 0:
-            def ping_master():
-                try:
-                    self._fire_master('ping', 'minion_ping')
-                except Exception:
-                    log.warning('Attempt to ping master failed.', exc_on_loglevel=logging.DEBUG)
-            self.periodic_callbacks['ping'] = tornado.ioloop.PeriodicCallback(ping_master, ping_interval * 1000, io_loop=self.io_loop)
+            self.periodic_callbacks['ping'] = tornado.ioloop.PeriodicCallback(self._ping_master, ping_interval * 1000, io_loop=self.io_loop)
 
         self.periodic_callbacks['cleanup'] = tornado.ioloop.PeriodicCallback(self._fallback_cleanups, loop_interval * 1000, io_loop=self.io_loop)
 
-        def handle_beacons():
-            # Process Beacons
-            beacons = None
-            try:
-                beacons = self.process_beacons(self.functions)
-            except Exception:
-                log.critical('The beacon errored: ', exc_info=True)
-            if beacons:
-                self._fire_master(events=beacons)
-
-        self.periodic_callbacks['beacons'] = tornado.ioloop.PeriodicCallback(handle_beacons, loop_interval * 1000, io_loop=self.io_loop)
+        self.periodic_callbacks['beacons'] = tornado.ioloop.PeriodicCallback(self._handle_beacons, loop_interval * 1000, io_loop=self.io_loop)
 
         # TODO: actually listen to the return and change period
-        def handle_schedule():
-            self.process_schedule(self, loop_interval)
         if hasattr(self, 'schedule'):
-            self.periodic_callbacks['schedule'] = tornado.ioloop.PeriodicCallback(handle_schedule, 1000, io_loop=self.io_loop)
+            self.periodic_callbacks['schedule'] = tornado.ioloop.PeriodicCallback(self._handle_schedule, 1000, io_loop=self.io_loop)
 
         # start all the other callbacks
         for periodic_cb in six.itervalues(self.periodic_callbacks):
@@ -1795,6 +2315,9 @@ class Minion(MinionBase):
                 self.destroy()
 
     def _handle_payload(self, payload):
+        if self._running is False:
+            # the minion is shutting down, do not start new jobs
+            return
         if payload is not None and payload['enc'] == 'aes':
             if self._target_load(payload['load']):
                 self._handle_decoded_payload(payload['load'])
@@ -1815,20 +2338,18 @@ class Minion(MinionBase):
         # pre-processing on the master and this minion should not see the
         # publication if the master does not determine that it should.
 
-        if 'tgt_type' in load:
+        tgt_type = load.get('tgt_type', 'glob')
+        try:
             match_func = getattr(self.matcher,
-                                 '{0}_match'.format(load['tgt_type']), None)
-            if match_func is None:
-                return False
-            if load['tgt_type'] in ('grain', 'grain_pcre', 'pillar'):
-                delimiter = load.get('delimiter', DEFAULT_TARGET_DELIM)
-                if not match_func(load['tgt'], delimiter=delimiter):
-                    return False
-            elif not match_func(load['tgt']):
-                return False
-        else:
-            if not self.matcher.glob_match(load['tgt']):
+                                 _match_func_names(type(self.matcher))[tgt_type])
+        except KeyError:
+            return False
+        if tgt_type in _DELIMITED_TGT_TYPES:
+            delimiter = load.get('delimiter', DEFAULT_TARGET_DELIM)
+            if not match_func(load['tgt'], delimiter=delimiter):
                 return False
+        elif not match_func(load['tgt']):
+            return False
 
         return True
 
@@ -1837,6 +2358,9 @@ class Minion(MinionBase):
         Tear down the minion
         '''
         self._running = False
+        if getattr(self, '_req_channel', None) is not None:
+            _close_channel(self._req_channel[1])
+        self._req_channel = None
         if hasattr(self, 'pub_channel'):
             self.pub_channel.on_recv(None)
             if hasattr(self.pub_channel, 'close'):
@@ -1850,7 +2374,28 @@ class Minion(MinionBase):
         self.destroy()
 
 
-class Syndic(Minion):
+class _SyndicEventAggregationMixin(object):
+    '''
+    Batching of the job returns and events the syndics forward to their
+    masters, the class provides the _forward_events method sending a batch
+    '''
+    def _reset_event_aggregation(self):
+        self.jids = {}
+        self.raw_events = []
+        self.event_count = 0
+
+    def _event_aggregated(self):
+        '''
+        Count an aggregated event or return and forward the batch right away
+        once syndic_event_forward_max is reached
+        '''
+        self.event_count += 1
+        forward_max = self.opts['syndic_event_forward_max']
+        if forward_max and self.event_count >= forward_max:
+            self._forward_events()
+
+
+class Syndic(_SyndicEventAggregationMixin, Minion):
     '''
     Make a Syndic minion, this minion will use the minion keys on the
     master to authenticate with a higher level master.
@@ -1863,7 +2408,8 @@ class Syndic(Minion):
         opts['loop_interval'] = 1
         super(Syndic, self).__init__(opts, **kwargs)
         self.mminion = salt.minion.MasterMinion(opts)
-        self.jid_forward_cache = set()
+        # jids whose load has been forwarded, oldest first
+        self.jid_forward_cache = OrderedDict()
 
     def _handle_decoded_payload(self, data):
         '''
@@ -1975,6 +2521,9 @@ class Syndic(Minion):
         self.pub_channel.on_recv(self._process_cmd_socket)
 
     def _process_cmd_socket(self, payload):
+        if self._running is False:
+            # the syndic is shutting down, do not forward new jobs
+            return
         if payload is not None and payload['enc'] == 'aes':
             log.trace('Handling payload')
             self._handle_decoded_payload(payload['load'])
@@ -1982,17 +2531,14 @@ class Syndic(Minion):
         # In the future, we could add support for some clearfuncs, but
         # the syndic currently has no need.
 
-    def _reset_event_aggregation(self):
-        self.jids = {}
-        self.raw_events = []
-
     def _process_event(self, raw):
         # TODO: cleanup: Move down into event class
         raw = raw[0]
         mtag, data = self.local.event.unpack(raw, self.local.event.serial)
         event = {'data': data, 'tag': mtag}
-        log.trace('Got event {0}'.format(event['tag']))
-        tag_parts = event['tag'].split('/')
+        log.trace('Got event %s', event['tag'])
+        # only the first four parts of the tag are looked at
+        tag_parts = event['tag'].split('/', 4)
         if len(tag_parts) >= 4 and tag_parts[1] == 'job' and \
             salt.utils.jid.is_jid(tag_parts[2]) and tag_parts[3] == 'ret' and \
             'return' in event['data']:
@@ -2004,27 +2550,27 @@ class Syndic(Minion):
                 jdict['__fun__'] = event['data'].get('fun')
                 jdict['__jid__'] = event['data']['jid']
                 jdict['__load__'] = {}
-                fstr = '{0}.get_load'.format(self.opts['master_job_cache'])
                 # Only need to forward each load once. Don't hit the disk
                 # for every minion return!
                 if event['data']['jid'] not in self.jid_forward_cache:
+                    fstr = '{0}.get_load'.format(self.opts['master_job_cache'])
                     jdict['__load__'].update(
                         self.mminion.returners[fstr](event['data']['jid'])
                         )
-                    self.jid_forward_cache.add(event['data']['jid'])
+                    self.jid_forward_cache[event['data']['jid']] = None
                     if len(self.jid_forward_cache) > self.opts['syndic_jid_forward_cache_hwm']:
                         # Pop the oldest jid from the cache
-                        tmp = sorted(list(self.jid_forward_cache))
-                        tmp.pop(0)
-                        self.jid_forward_cache = set(tmp)
+                        self.jid_forward_cache.popitem(last=False)
             if 'master_id' in event['data']:
                 # __'s to make sure it doesn't print out on the master cli
                 jdict['__master_id__'] = event['data']['master_id']
             jdict[event['data']['id']] = event['data']['return']
+            self._event_aggregated()
         else:
             # Add generic event aggregation here
             if 'retcode' not in event['data']:
                 self.raw_events.append(event)
+                self._event_aggregated()
 
     def _forward_events(self):
         log.trace('Forwarding events')
@@ -2032,10 +2578,10 @@ class Syndic(Minion):
             self._fire_master(events=self.raw_events,
                               pretag=tagify(self.opts['id'], base='syndic'),
                               )
-        for jid in self.jids:
-            self._return_pub(self.jids[jid],
-                             '_syndic_return',
-                             timeout=self._return_retry_timer())
+        if self.jids:
+            self._return_pub_multi(list(six.itervalues(self.jids)),
+                                   '_syndic_return',
+                                   timeout=self._return_retry_timer())
         self._reset_event_aggregation()
 
     def destroy(self):
@@ -2054,7 +2600,7 @@ class Syndic(Minion):
 
 # TODO: consolidate syndic classes together?
 # need a way of knowing if the syndic connection is busted
-class MultiSyndic(MinionBase):
+class MultiSyndic(_SyndicEventAggregationMixin, MinionBase):
     '''
     Make a MultiSyndic minion, this minion will handle relaying jobs and returns from
     all minions connected to it to the list of masters it is connected to.
@@ -2088,7 +2634,9 @@ class MultiSyndic(MinionBase):
         self.max_auth_wait = self.opts['acceptance_wait_time_max']
 
         self._has_master = threading.Event()
-        self.jid_forward_cache = set()
+        self.jid_forward_cache = OrderedDict()
+        # start of the master list for the next iter_master_options call
+        self._master_rr = 0
 
         if io_loop is None:
             self.io_loop = zmq.eventloop.ioloop.ZMQIOLoop()
@@ -2105,6 +2653,9 @@ class MultiSyndic(MinionBase):
             s_opts = copy.copy(self.opts)
             s_opts['master'] = master
             self._syndics[master] = self._connect_syndic(s_opts)
+        # the masters never change once spawned, keep their list at hand for
+        # iter_master_options
+        self._syndic_masters = list(self._syndics)
 
     @tornado.gen.coroutine
     def _connect_syndic(self, opts):
@@ -2128,14 +2679,15 @@ class MultiSyndic(MinionBase):
                 break
             except SaltClientError as exc:
                 log.error('Error while bringing up syndic for multi-syndic. Is master at {0} responding?'.format(opts['master']))
-                last = time.time()
-                if auth_wait < self.max_auth_wait:
-                    auth_wait += self.auth_wait
-                yield tornado.gen.sleep(auth_wait)  # TODO: log?
             except KeyboardInterrupt:
                 raise
             except:  # pylint: disable=W0702
                 log.critical('Unexpected error while connecting to {0}'.format(opts['master']), exc_info=True)
+            # back off before the next attempt, also after an unexpected
+            # error, which would otherwise retry in a busy loop
+            if auth_wait < self.max_auth_wait:
+                auth_wait += self.auth_wait
+            yield tornado.gen.sleep(auth_wait)  # TODO: log?
 
         raise tornado.gen.Return(syndic)
 
@@ -2175,8 +2727,12 @@ class MultiSyndic(MinionBase):
         '''
         Iterate (in order) over your options for master
         '''
-        masters = list(self._syndics.keys())
-        shuffle(masters)
+        # Rotate the list instead of shuffling it, calls without a known
+        # master still start with a different one each time
+        masters = self._syndic_masters
+        start = self._master_rr % len(masters)
+        self._master_rr += 1
+        masters = masters[start:] + masters[:start]
         if master_id not in self._syndics:
             master_id = masters.pop(0)
         else:
@@ -2188,10 +2744,6 @@ class MultiSyndic(MinionBase):
                 break
             master_id = masters.pop(0)
 
-    def _reset_event_aggregation(self):
-        self.jids = {}
-        self.raw_events = []
-
     # Syndic Tune In
     def tune_in(self):
         '''
@@ -2225,9 +2777,9 @@ class MultiSyndic(MinionBase):
         raw = raw[0]
         mtag, data = self.local.event.unpack(raw, self.local.event.serial)
         event = {'data': data, 'tag': mtag}
-        log.trace('Got event {0}'.format(event['tag']))
-
-        tag_parts = event['tag'].split('/')
+        log.trace('Got event %s', event['tag'])
+        # only the first four parts of the tag are looked at
+        tag_parts = event['tag'].split('/', 4)
         if len(tag_parts) >= 4 and tag_parts[1] == 'job' and \
             salt.utils.jid.is_jid(tag_parts[2]) and tag_parts[3] == 'ret' and \
             'return' in event['data']:
@@ -2243,23 +2795,22 @@ class MultiSyndic(MinionBase):
                 jdict['__fun__'] = event['data'].get('fun')
                 jdict['__jid__'] = event['data']['jid']
                 jdict['__load__'] = {}
-                fstr = '{0}.get_load'.format(self.opts['master_job_cache'])
                 # Only need to forward each load once. Don't hit the disk
                 # for every minion return!
                 if event['data']['jid'] not in self.jid_forward_cache:
+                    fstr = '{0}.get_load'.format(self.opts['master_job_cache'])
                     jdict['__load__'].update(
                         self.mminion.returners[fstr](event['data']['jid'])
                         )
-                    self.jid_forward_cache.add(event['data']['jid'])
+                    self.jid_forward_cache[event['data']['jid']] = None
                     if len(self.jid_forward_cache) > self.opts['syndic_jid_forward_cache_hwm']:
                         # Pop the oldest jid from the cache
-                        tmp = sorted(list(self.jid_forward_cache))
-                        tmp.pop(0)
-                        self.jid_forward_cache = set(tmp)
+                        self.jid_forward_cache.popitem(last=False)
             if 'master_id' in event['data']:
                 # __'s to make sure it doesn't print out on the master cli
                 jdict['__master_id__'] = event['data']['master_id']
             jdict[event['data']['id']] = event['data']['return']
+            self._event_aggregated()
         else:
             # TODO: config to forward these? If so we'll have to keep track of who
             # has seen them
@@ -2268,6 +2819,7 @@ class MultiSyndic(MinionBase):
                 # Add generic event aggregation here
                 if 'retcode' not in event['data']:
                     self.raw_events.append(event)
+                    self._event_aggregated()
 
     def _forward_events(self):
         log.trace('Forwarding events')
@@ -2278,16 +2830,189 @@ class MultiSyndic(MinionBase):
                                       'timeout': self.SYNDIC_EVENT_TIMEOUT,
                                       },
                               )
-        for jid, jid_ret in self.jids.items():
-            self._call_syndic('_return_pub',
-                              args=(jid_ret, '_syndic_return'),
+        # send the returns for each master in one request
+        master_rets = {}
+        for jid_ret in six.itervalues(self.jids):
+            master_rets.setdefault(jid_ret.get('__master_id__'), []).append(jid_ret)
+        for master_id, rets in six.iteritems(master_rets):
+            self._call_syndic('_return_pub_multi',
+                              args=(rets, '_syndic_return'),
                               kwargs={'timeout': self.SYNDIC_EVENT_TIMEOUT},
-                              master_id=jid_ret.get('__master_id__'),
+                              master_id=master_id,
                               )
 
         self._reset_event_aggregation()
 
 
+# Number of compiled patterns kept in each of the target caches below
+_TGT_CACHE_MAX = 512
+
+# Compiled target regexes, keyed by pattern. The re module keeps a cache of
+# its own, but looking the pattern up there costs more than the match itself
+# and on Python 2 the cache only holds 100 patterns.
+_PCRE_CACHE = {}
+
+
+def _compile_pcre(pattern):
+    '''
+    Return the compiled regex for pattern from the cache, compiling it on the
+    first use
+    '''
+    try:
+        return _PCRE_CACHE[pattern]
+    except KeyError:
+        pass
+    regex = re.compile(pattern)
+    if len(_PCRE_CACHE) >= _TGT_CACHE_MAX:
+        _PCRE_CACHE.clear()
+    _PCRE_CACHE[pattern] = regex
+    return regex
+
+
+# Compiled glob targets, keyed by glob. fnmatch.fnmatch translates and looks
+# up the pattern on every call and its own cache is flushed after 100 globs.
+# Globs without wildcards are stored as None and compared as plain strings.
+_GLOB_CACHE = {}
+_GLOB_MAGIC_RE = re.compile(r'[*?[]')
+
+
+def _compile_glob(pattern):
+    '''
+    Return the compiled regex for the glob pattern from the cache, or None if
+    the pattern has no wildcards. The pattern is case-normalized like
+    fnmatch.fnmatch does, so the matched name must be passed through
+    os.path.normcase as well.
+    '''
+    try:
+        return _GLOB_CACHE[pattern]
+    except KeyError:
+        pass
+    if _GLOB_MAGIC_RE.search(pattern) is None:
+        regex = None
+    else:
+        regex = re.compile(fnmatch.translate(os.path.normcase(pattern)))
+    if len(_GLOB_CACHE) >= _TGT_CACHE_MAX:
+        _GLOB_CACHE.clear()
+    _GLOB_CACHE[pattern] = regex
+    return regex
+
+
+def _fnmatch(name, pattern):
+    '''
+    Cached equivalent of fnmatch.fnmatch
+    '''
+    regex = _compile_glob(pattern)
+    if regex is None:
+        return os.path.normcase(name) == os.path.normcase(pattern)
+    return regex.match(os.path.normcase(name)) is not None
+
+
+# Parsed ipcidr targets, keyed by target. Each entry is a tuple of the grain
+# holding the minion's addresses, the address as a string for address targets
+# and the network object for CIDR targets, or None for invalid targets.
+_IPCIDR_CACHE = {}
+
+
+def _parse_ipcidr(tgt):
+    '''
+    Return the parsed ipcidr target from the cache, parsing it on the first use
+    '''
+    try:
+        return _IPCIDR_CACHE[tgt]
+    except KeyError:
+        pass
+    try:
+        # Target is an address?
+        addr = ipaddress.ip_address(tgt)
+        parsed = ('ipv{0}'.format(addr.version), str(addr), None)
+    except:  # pylint: disable=bare-except
+        try:
+            # Target is a network?
+            net = ipaddress.ip_network(tgt)
+            parsed = ('ipv{0}'.format(net.version), None, net)
+        except:  # pylint: disable=bare-except
+            parsed = None
+    if len(_IPCIDR_CACHE) >= _TGT_CACHE_MAX:
+        _IPCIDR_CACHE.clear()
+    _IPCIDR_CACHE[tgt] = parsed
+    return parsed
+
+
+# Parsed compound target words, keyed by word. The same words come up for
+# every state of a top file, so the regex in parse_target runs once per word.
+_TARGET_INFO_CACHE = {}
+
+
+def _parse_target(word):
+    '''
+    Return the result of salt.utils.minions.parse_target for word from the
+    cache. The returned dict is shared and must not be modified.
+    '''
+    try:
+        return _TARGET_INFO_CACHE[word]
+    except KeyError:
+        pass
+    target_info = salt.utils.minions.parse_target(word)
+    if len(_TARGET_INFO_CACHE) >= _TGT_CACHE_MAX:
+        _TARGET_INFO_CACHE.clear()
+    _TARGET_INFO_CACHE[word] = target_info
+    return target_info
+
+
+def _eval_bool_tokens(tokens):
+    '''
+    Evaluate a list of True/False values and 'and', 'or', 'not', '(' and ')'
+    tokens with the same precedence as Python. Raises ValueError if the tokens
+    do not form a valid expression.
+    '''
+    pos = [0]
+
+    def _next():
+        if pos[0] >= len(tokens):
+            raise ValueError('unexpected end of expression')
+        token = tokens[pos[0]]
+        pos[0] += 1
+        return token
+
+    def _peek():
+        if pos[0] < len(tokens):
+            return tokens[pos[0]]
+        return None
+
+    def _or_expr():
+        value = _and_expr()
+        while _peek() == 'or':
+            pos[0] += 1
+            # Both operands are parsed so that syntax errors are not hidden
+            value = _and_expr() or value
+        return value
+
+    def _and_expr():
+        value = _not_expr()
+        while _peek() == 'and':
+            pos[0] += 1
+            value = _not_expr() and value
+        return value
+
+    def _not_expr():
+        token = _next()
+        if token == 'not':
+            return not _not_expr()
+        if token == '(':
+            value = _or_expr()
+            if _next() != ')':
+                raise ValueError('missing closing parenthesis')
+            return value
+        if token is True or token is False:
+            return token
+        raise ValueError('unexpected token {0!r}'.format(token))
+
+    value = _or_expr()
+    if pos[0] != len(tokens):
+        raise ValueError('unexpected token {0!r}'.format(tokens[pos[0]]))
+    return value
+
+
 class Matcher(object):
     '''
     Use to return the value for matching calls from the master
@@ -2310,15 +3035,13 @@ class Matcher(object):
             if isinstance(item, dict):
                 if 'match' in item:
                     matcher = item['match']
-        if hasattr(self, matcher + '_match'):
-            funcname = '{0}_match'.format(matcher)
+        funcname = _match_func_names(type(self)).get(matcher)
+        if funcname:
             if matcher == 'nodegroup':
                 return getattr(self, funcname)(match, nodegroups)
             return getattr(self, funcname)(match)
         else:
-            log.error('Attempting to match with unknown matcher: {0}'.format(
-                matcher
-            ))
+            log.error('Attempting to match with unknown matcher: %s', matcher)
             return False
 
     def glob_match(self, tgt):
@@ -2328,13 +3051,13 @@ class Matcher(object):
         if not isinstance(tgt, six.string_types):
             return False
 
-        return fnmatch.fnmatch(self.opts['id'], tgt)
+        return _fnmatch(self.opts['id'], tgt)
 
     def pcre_match(self, tgt):
         '''
         Returns true if the passed pcre regex matches
         '''
-        return bool(re.match(tgt, self.opts['id']))
+        return bool(_compile_pcre(tgt).match(self.opts['id']))
 
     def list_match(self, tgt):
         '''
@@ -2348,7 +3071,7 @@ class Matcher(object):
         '''
         Reads in the grains glob match
         '''
-        log.debug('grains target: {0}'.format(tgt))
+        log.debug('grains target: %s', tgt)
         if delimiter not in tgt:
             log.error('Got insufficient arguments for grains match '
                       'statement from master')
@@ -2361,7 +3084,7 @@ class Matcher(object):
         '''
         Matches a grain based on regex
         '''
-        log.debug('grains pcre target: {0}'.format(tgt))
+        log.debug('grains pcre target: %s', tgt)
         if delimiter not in tgt:
             log.error('Got insufficient arguments for grains pcre match '
                       'statement from master')
@@ -2385,24 +3108,22 @@ class Matcher(object):
             return False
         if isinstance(val, list):
             # We are matching a single component to a single list member
+            pattern = comps[1].lower()
             for member in val:
-                if fnmatch.fnmatch(str(member).lower(), comps[1].lower()):
+                if _fnmatch(str(member).lower(), pattern):
                     return True
             return False
         if isinstance(val, dict):
             if comps[1] in val:
                 return True
             return False
-        return bool(fnmatch.fnmatch(
-            val,
-            comps[1],
-        ))
+        return _fnmatch(val, comps[1])
 
     def pillar_match(self, tgt, delimiter=DEFAULT_TARGET_DELIM):
         '''
         Reads in the pillar glob match
         '''
-        log.debug('pillar target: {0}'.format(tgt))
+        log.debug('pillar target: %s', tgt)
         if delimiter not in tgt:
             log.error('Got insufficient arguments for pillar match '
                       'statement from master')
@@ -2415,7 +3136,7 @@ class Matcher(object):
         '''
         Reads in the pillar pcre match
         '''
-        log.debug('pillar PCRE target: {0}'.format(tgt))
+        log.debug('pillar PCRE target: %s', tgt)
         if delimiter not in tgt:
             log.error('Got insufficient arguments for pillar PCRE match '
                       'statement from master')
@@ -2428,7 +3149,7 @@ class Matcher(object):
         '''
         Reads in the pillar match, no globbing, no PCRE
         '''
-        log.debug('pillar target: {0}'.format(tgt))
+        log.debug('pillar target: %s', tgt)
         if delimiter not in tgt:
             log.error('Got insufficient arguments for pillar match '
                       'statement from master')
@@ -2442,26 +3163,20 @@ class Matcher(object):
         '''
         Matches based on IP address or CIDR notation
         '''
-        try:
-            # Target is an address?
-            tgt = ipaddress.ip_address(tgt)
-        except:  # pylint: disable=bare-except
-            try:
-                # Target is a network?
-                tgt = ipaddress.ip_network(tgt)
-            except:  # pylint: disable=bare-except
-                log.error('Invalid IP/CIDR target: {0}'.format(tgt))
-                return []
-        proto = 'ipv{0}'.format(tgt.version)
+        parsed = _parse_ipcidr(tgt)
+        if parsed is None:
+            log.error('Invalid IP/CIDR target: %s', tgt)
+            return []
+        proto, addr, net = parsed
 
         grains = self.opts['grains']
 
         if proto not in grains:
             match = False
-        elif isinstance(tgt, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
-            match = str(tgt) in grains[proto]
+        elif addr is not None:
+            match = addr in grains[proto]
         else:
-            match = salt.utils.network.in_subnet(tgt, grains[proto])
+            match = salt.utils.network.in_subnet(net, grains[proto])
 
         return match
 
@@ -2474,7 +3189,7 @@ class Matcher(object):
             try:
                 return self.opts['grains']['fqdn'] in range_.expand(tgt)
             except seco.range.RangeException as exc:
-                log.debug('Range exception in compound match: {0}'.format(exc))
+                log.debug('Range exception in compound match: %s', exc)
                 return False
         return False
 
@@ -2485,18 +3200,7 @@ class Matcher(object):
         if not isinstance(tgt, six.string_types) and not isinstance(tgt, (list, tuple)):
             log.error('Compound target received that is neither string, list nor tuple')
             return False
-        log.debug('compound_match: {0} ? {1}'.format(self.opts['id'], tgt))
-        ref = {'G': 'grain',
-               'P': 'grain_pcre',
-               'I': 'pillar',
-               'J': 'pillar_pcre',
-               'L': 'list',
-               'N': None,      # Nodegroups should already be expanded
-               'S': 'ipcidr',
-               'E': 'pcre'}
-        if HAS_RANGE:
-            ref['R'] = 'range'
-
+        log.debug('compound_match: %s ? %s', self.opts['id'], tgt)
         results = []
         opers = ['and', 'or', 'not', '(', ')']
 
@@ -2506,13 +3210,11 @@ class Matcher(object):
             words = tgt
 
         for word in words:
-            target_info = salt.utils.minions.parse_target(word)
-
             # Easy check first
             if word in opers:
                 if results:
                     if results[-1] == '(' and word in ('and', 'or'):
-                        log.error('Invalid beginning operator after "(": {0}'.format(word))
+                        log.error('Invalid beginning operator after "(": %s', word)
                         return False
                     if word == 'not':
                         if not results[-1] in ('and', 'or', '('):
@@ -2521,24 +3223,24 @@ class Matcher(object):
                 else:
                     # seq start with binary oper, fail
                     if word not in ['(', 'not']:
-                        log.error('Invalid beginning operator: {0}'.format(word))
+                        log.error('Invalid beginning operator: %s', word)
                         return False
                     results.append(word)
+                continue
 
-            elif target_info and target_info['engine']:
+            target_info = _parse_target(word)
+            if target_info and target_info['engine']:
                 if 'N' == target_info['engine']:
                     # Nodegroups should already be expanded/resolved to other engines
-                    log.error('Detected nodegroup expansion failure of "{0}"'.format(word))
+                    log.error('Detected nodegroup expansion failure of "%s"', word)
                     return False
-                engine = ref.get(target_info['engine'])
-                if not engine:
+                funcname = _COMPOUND_ENGINES.get(target_info['engine'])
+                if not funcname:
                     # If an unknown engine is called at any time, fail out
-                    log.error('Unrecognized target engine "{0}" for'
-                              ' target expression "{1}"'.format(
-                                  target_info['engine'],
-                                  word,
-                                )
-                        )
+                    log.error('Unrecognized target engine "%s" for'
+                              ' target expression "%s"',
+                              target_info['engine'],
+                              word)
                     return False
 
                 engine_args = [target_info['pattern']]
@@ -2547,19 +3249,18 @@ class Matcher(object):
                     engine_kwargs['delimiter'] = target_info['delimiter']
 
                 results.append(
-                    str(getattr(self, '{0}_match'.format(engine))(*engine_args, **engine_kwargs))
+                    bool(getattr(self, funcname)(*engine_args, **engine_kwargs))
                 )
 
             else:
                 # The match is not explicitly defined, evaluate it as a glob
-                results.append(str(self.glob_match(word)))
+                results.append(bool(self.glob_match(word)))
 
-        results = ' '.join(results)
-        log.debug('compound_match {0} ? "{1}" => "{2}"'.format(self.opts['id'], tgt, results))
+        log.debug('compound_match %s ? "%s" => "%s"', self.opts['id'], tgt, results)
         try:
-            return eval(results)  # pylint: disable=W0123
-        except Exception:
-            log.error('Invalid compound target: {0} for results: {1}'.format(tgt, results))
+            return _eval_bool_tokens(results)
+        except ValueError:
+            log.error('Invalid compound target: %s for results: %s', tgt, results)
             return False
         return False
 
@@ -2576,6 +3277,39 @@ class Matcher(object):
         return False
 
 
+# Map a Matcher class to its map of target types to the names of the methods
+# matching them, filled on first use so that subclasses can add matchers
+_MATCH_FUNC_NAMES = {}
+
+
+def _match_func_names(matcher_cls):
+    '''
+    Return the map of target types to matcher method names of a Matcher class
+    '''
+    try:
+        return _MATCH_FUNC_NAMES[matcher_cls]
+    except KeyError:
+        names = dict(
+            (name[:-len('_match')], name)
+            for name in dir(matcher_cls) if name.endswith('_match')
+        )
+        _MATCH_FUNC_NAMES[matcher_cls] = names
+        return names
+
+# Map the engine letters of compound targets to the Matcher method names, which
+# are looked up on the instance so that subclasses can override them
+_COMPOUND_ENGINES = {'G': 'grain_match',
+                     'P': 'grain_pcre_match',
+                     'I': 'pillar_match',
+                     'J': 'pillar_pcre_match',
+                     'L': 'list_match',
+                     'N': None,      # Nodegroups should already be expanded
+                     'S': 'ipcidr_match',
+                     'E': 'pcre_match'}
+if HAS_RANGE:
+    _COMPOUND_ENGINES['R'] = 'range_match'
+
+
 class ProxyMinion(Minion):
     '''
     This class instantiates a 'proxy' minion--a minion that does not manipulate
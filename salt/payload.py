@@ -11,6 +11,7 @@ from __future__ import absolute_import
 import logging
 import gc
 import datetime
+import threading
 
 # Import salt libs
 import salt.log
@@ -67,6 +68,22 @@ if HAS_MSGPACK and not hasattr(msgpack, 'exceptions'):
     msgpack.exceptions = exceptions()
 
 
+# One msgpack Packer per thread, reused by Serial.dumps instead of creating a
+# new one for every message. A Packer is not thread safe.
+_PACKERS = threading.local()
+
+
+def _get_packer():
+    '''
+    Return the msgpack Packer of the current thread, or None if the msgpack
+    library in use does not provide one
+    '''
+    packer = getattr(_PACKERS, 'packer', None)
+    if packer is None and hasattr(msgpack, 'Packer'):
+        packer = _PACKERS.packer = msgpack.Packer()
+    return packer
+
+
 def package(payload):
     '''
     This method for now just wraps msgpack.dumps, but it is here so that
@@ -138,7 +155,16 @@ class Serial(object):
         Run the correct dumps serialization format
         '''
         try:
-            return msgpack.dumps(msg)
+            packer = _get_packer()
+            if packer is None:
+                return msgpack.dumps(msg)
+            try:
+                return packer.pack(msg)
+            except Exception:
+                # A failed pack can leave partial data in the packer's
+                # buffer, start over with a new packer next time
+                _PACKERS.packer = None
+                raise
         except (OverflowError, msgpack.exceptions.PackValueError):
             # msgpack can't handle the very long Python longs for jids
             # Convert any very long longs to strings
@@ -2805,11 +2805,13 @@ def cache_node_list(nodes, provider, opts):
     # Check to see if any nodes in the cache are not in the new list
     missing_node_cache(prov_dir, nodes, provider, opts)
 
+    # msgpack.dump() builds a new Packer for every call, share one instead
+    packer = msgpack.Packer()
     for node in nodes:
         diff_node_cache(prov_dir, node, nodes[node], opts)
         path = os.path.join(prov_dir, '{0}.p'.format(node))
         with salt.utils.fopen(path, 'w') as fh_:
-            msgpack.dump(nodes[node], fh_)
+            fh_.write(packer.pack(nodes[node]))
 
 
 def cache_node(node, provider, opts):
@@ -2852,8 +2854,9 @@ def missing_node_cache(prov_dir, node_list, provider, opts):
     for node in os.listdir(prov_dir):
         cached_nodes.append(os.path.splitext(node)[0])
 
-    log.debug(sorted(cached_nodes))
-    log.debug(sorted(node_list))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(sorted(cached_nodes))
+        log.debug(sorted(node_list))
     for node in cached_nodes:
         if node not in node_list:
             delete_minion_cachedir(node, provider, opts)
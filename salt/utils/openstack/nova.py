@@ -38,6 +38,9 @@ log = logging.getLogger(__name__)
 # Version added to novaclient.client.Client function
 NOVACLIENT_MINVER = '2.6.1'
 
+# Version adding the connection_pool argument to novaclient.client.Client
+NOVACLIENT_POOL_MINVER = '2.18.0'
+
 # dict for block_device_mapping_v2
 CLIENT_BDM2_KEYS = {
     'id': 'uuid',
@@ -171,7 +174,7 @@ def sanatize_novaclient(kwargs):
         'endpoint_type', 'extensions', 'service_type', 'service_name',
         'volume_service_name', 'timings', 'bypass_url', 'os_cache',
         'no_cache', 'http_log_debug', 'auth_system', 'auth_plugin',
-        'auth_token', 'cacert', 'tenant_id'
+        'auth_token', 'cacert', 'tenant_id', 'connection_pool'
     )
     ret = {}
     for var in kwargs:
@@ -230,6 +233,11 @@ class SaltNova(object):
         if not self.kwargs.get('api_key', None):
             self.kwargs['api_key'] = password
 
+        # Reuse keep-alive HTTP connections between requests instead of
+        # paying the TCP/TLS handshake for every call
+        if LooseVersion(novaclient.__version__) >= LooseVersion(NOVACLIENT_POOL_MINVER):
+            self.kwargs.setdefault('connection_pool', True)
+
         # This has to be run before sanatize_novaclient before extra variables are cleaned out.
         if hasattr(self, 'extensions'):
             # needs an object, not a dictionary
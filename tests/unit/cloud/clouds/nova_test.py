@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.unit.cloud.clouds.nova_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+
+# Import Salt Testing Libs
+from salttesting import TestCase, skipIf
+from salttesting.mock import MagicMock, NO_MOCK, NO_MOCK_REASON, patch
+from salttesting.helpers import ensure_in_syspath
+
+ensure_in_syspath('../../../')
+
+# Import Salt Libs
+from salt.cloud.clouds import nova
+
+# Global Variables
+nova.__active_provider_name__ = 'my-nova:nova'
+nova.__opts__ = {}
+nova.__utils__ = {'cloud.cache_node_list': MagicMock()}
+
+
+def _server(server_id, addr='10.0.0.1'):
+    return {'id': server_id,
+            'image': {'id': 'image'},
+            'flavor': {'id': 'flavor'},
+            'state': 'ACTIVE',
+            'metadata': {},
+            'accessIPv4': '',
+            'accessIPv6': '',
+            'addresses': {'private': [{'addr': addr}]}}
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class NovaNodesCacheTestCase(TestCase):
+    '''
+    Unit TestCase for the node listing cache of salt.cloud.clouds.nova
+    '''
+    def setUp(self):
+        getattr(nova, '__NODES_CACHE').clear()
+        self.provider = {}
+        self.conn = MagicMock()
+        self.conn.server_list_detailed.return_value = {'web1': _server('1')}
+        patcher = patch('salt.cloud.clouds.nova.get_configured_provider',
+                        MagicMock(return_value=self.provider))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('salt.cloud.clouds.nova.get_conn',
+                        MagicMock(return_value=self.conn))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        getattr(nova, '__NODES_CACHE').clear()
+
+    def test_nodes_cache_disabled(self):
+        '''
+        Node listings are not cached unless nodes_cache_ttl is set
+        '''
+        nova.list_nodes()
+        nova.list_nodes_full()
+        self.assertEqual(self.conn.server_list_detailed.call_count, 2)
+        self.assertEqual(getattr(nova, '__NODES_CACHE'), {})
+
+    def test_nodes_cache_expiry(self):
+        '''
+        A cached listing is shared by list_nodes and list_nodes_full until
+        nodes_cache_ttl expires
+        '''
+        self.provider['nodes_cache_ttl'] = 10
+        with patch('time.time', MagicMock(return_value=1000)):
+            self.assertEqual(nova.list_nodes()['web1']['id'], '1')
+            self.assertEqual(nova.list_nodes_full()['web1']['id'], '1')
+            self.assertEqual(nova.list_nodes()['web1']['id'], '1')
+        self.assertEqual(self.conn.server_list_detailed.call_count, 1)
+        with patch('time.time', MagicMock(return_value=1010)):
+            nova.list_nodes()
+        self.assertEqual(self.conn.server_list_detailed.call_count, 2)
+
+    def test_nodes_cache_copies(self):
+        '''
+        Callers modifying a listing do not change the cached one
+        '''
+        self.provider['nodes_cache_ttl'] = 10
+        nodes = nova.list_nodes()
+        nodes['web1']['private_ips'].append('10.0.0.2')
+        del nodes['web1']
+        self.assertEqual(nova.list_nodes()['web1']['private_ips'], ['10.0.0.1'])
+
+    def test_nodes_cache_invalidation(self):
+        '''
+        Actions changing nodes or volumes drop the cached listings
+        '''
+        self.provider['nodes_cache_ttl'] = 10
+        with patch('salt.cloud.clouds.nova._libcloud_reboot', MagicMock(return_value=True)):
+            for action in (lambda: nova.volume_create('vol1'),
+                           lambda: nova.volume_attach('vol1', 'web1'),
+                           lambda: nova.volume_detach('vol1'),
+                           lambda: nova.volume_delete('vol1'),
+                           lambda: nova.reboot('web1')):
+                nova.list_nodes()
+                self.assertNotEqual(getattr(nova, '__NODES_CACHE'), {})
+                action()
+                self.assertEqual(getattr(nova, '__NODES_CACHE'), {})
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class NovaTestCase(TestCase):
+    '''
+    Unit TestCase for salt.cloud.clouds.nova module.
+    '''
+    def setUp(self):
+        getattr(nova, '__CONN_CACHE').clear()
+        getattr(nova, '__NODES_CACHE').clear()
+        self.provider = {'user': 'user', 'tenant': 'tenant',
+                         'identity_url': 'http://keystone', 'compute_region': 'region'}
+        patcher = patch('salt.cloud.clouds.nova.get_configured_provider',
+                        MagicMock(return_value=self.provider))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        getattr(nova, '__CONN_CACHE').clear()
+        getattr(nova, '__NODES_CACHE').clear()
+
+    def test_get_conn_cache(self):
+        '''
+        The authenticated connection is reused until conn_cache_ttl expires
+        '''
+        self.provider['conn_cache_ttl'] = 60
+        with patch('salt.utils.openstack.nova.SaltNova', MagicMock()) as salt_nova:
+            with patch('time.time', MagicMock(return_value=1000)):
+                conn = nova.get_conn()
+                self.assertIs(nova.get_conn(), conn)
+            self.assertEqual(salt_nova.call_count, 1)
+            with patch('time.time', MagicMock(return_value=1060)):
+                nova.get_conn()
+            self.assertEqual(salt_nova.call_count, 2)
+
+    def test_get_conn_auth_error(self):
+        '''
+        A cached connection whose token was revoked is dropped and the call is
+        retried once with a new connection
+        '''
+        class AuthError(Exception):
+            pass
+
+        stale = MagicMock()
+        stale.server_list.side_effect = AuthError
+        fresh = MagicMock()
+        fresh.server_list.return_value = {'web1': {'id': '1'}}
+        with patch('salt.cloud.clouds.nova.AUTH_ERRORS', (AuthError,)):
+            with patch('salt.utils.openstack.nova.SaltNova',
+                       MagicMock(side_effect=[stale, fresh, fresh])) as salt_nova:
+                conn = nova.get_conn()
+                self.assertEqual(conn.server_list(), {'web1': {'id': '1'}})
+                self.assertEqual(salt_nova.call_count, 2)
+                new_conn = nova.get_conn()
+                self.assertIsNot(new_conn, conn)
+                self.assertIs(new_conn.conn, fresh)
+                self.assertEqual(salt_nova.call_count, 2)
+
+                fresh.server_list.side_effect = AuthError
+                self.assertRaises(AuthError, new_conn.server_list)
+                self.assertEqual(salt_nova.call_count, 3)
+
+    def test_server_list_detail_fallback(self):
+        '''
+        Without a detailed listing every server is looked up on its own, servers
+        deleted in the meantime are skipped
+        '''
+        conn = MagicMock(spec=['server_list', 'server_show'])
+        conn.server_list.return_value = {'web1': {'id': '1'}, 'web2': {'id': '2'},
+                                         'gone': {'id': '3'}}
+        servers = {'1': {'web1': _server('1')}, '2': {'web2': _server('2')}, '3': {}}
+        conn.server_show.side_effect = lambda server_id: servers[server_id]
+        self.assertEqual(nova._server_list_detail(conn),
+                         {'web1': _server('1'), 'web2': _server('2')})
+        self.assertEqual(conn.server_show.call_count, 3)
+
+        conn.server_list.return_value = {}
+        self.assertEqual(nova._server_list_detail(conn), {})
+
+    def test_list_nodes_full_missing_id(self):
+        '''
+        A server without an id is left out instead of failing the listing
+        '''
+        conn = MagicMock(password=None)
+        server = _server(None)
+        conn.server_list_detailed.return_value = {'web1': _server('1'), 'broken': server}
+        with patch('salt.cloud.clouds.nova.get_conn', MagicMock(return_value=conn)):
+            nodes = nova.list_nodes_full()
+        self.assertEqual(list(nodes), ['web1'])
+        self.assertEqual(nodes['web1']['private_ips'], ['10.0.0.1'])
+
+    def test_volume_create_attach(self):
+        '''
+        All volumes are created and attached, failed attachments are left out
+        of the result
+        '''
+        volumes = [{'name': 'vol{0}'.format(num), 'size': 10} for num in range(3)]
+        create = MagicMock(side_effect=lambda **kwargs: {'id': kwargs['name'] + '-id'})
+        attach = MagicMock(side_effect=lambda name, **kwargs: name != 'vol1')
+        with patch('salt.cloud.clouds.nova.create_volume', create):
+            with patch('salt.cloud.clouds.nova.attach_volume', attach):
+                ret = nova.volume_create_attach('web1', call='action', volumes=volumes)
+        self.assertEqual(sorted(ret), ['vol0-id attached to web1 (aka vol0)',
+                                       'vol2-id attached to web1 (aka vol2)'])
+        self.assertEqual(create.call_count, 3)
+        self.assertEqual(nova.volume_create_attach('web1', call='action', volumes=[]), [])
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(NovaNodesCacheTestCase, NovaTestCase, needs_daemon=False)
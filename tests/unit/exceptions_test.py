@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.unit.exceptions_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+
+ensure_in_syspath('../')
+
+# Import Salt libs
+from salt.exceptions import SaltRenderError, get_error_message
+
+
+class SaltRenderErrorTestCase(TestCase):
+    def test_message_with_context(self):
+        '''
+        The location of the error is part of the message in args and str()
+        '''
+        exc = SaltRenderError('Jinja syntax error', line_num=2,
+                              buf='first\nsecond\nthird', marker='  <==')
+        self.assertEqual(exc.context, '---\nfirst\nsecond  <==\nthird\n---')
+        message = 'Jinja syntax error; line 2\n\n{0}'.format(exc.context)
+        self.assertEqual(exc.args, (message,))
+        self.assertEqual(str(exc), message)
+        self.assertEqual(exc.strerror, message)
+        self.assertEqual(get_error_message(exc), message)
+        self.assertEqual(exc.pack(), {'message': message, 'args': (message,)})
+
+    def test_message_without_context(self):
+        '''
+        Without a buffer only the message and the trace are used
+        '''
+        exc = SaltRenderError('Render failed', trace='Traceback')
+        self.assertEqual(exc.context, '')
+        self.assertEqual(exc.args, ('Render failed\nTraceback\n',))
+        self.assertEqual(str(exc), 'Render failed\nTraceback\n')
+        self.assertEqual(exc.error, 'Render failed')
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(SaltRenderErrorTestCase, needs_daemon=False)
@@ -5,18 +5,29 @@
 
 # Import python libs
 from __future__ import absolute_import
+import collections
 import os
+import shutil
+import tempfile
+import threading
+from random import sample
+
+# Import 3rd-party libs
+import tornado.gen
+import tornado.testing
 
 # Import Salt Testing libs
 from salttesting import TestCase, skipIf
 from salttesting.helpers import ensure_in_syspath
-from salttesting.mock import NO_MOCK, NO_MOCK_REASON, patch
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, ANY, MagicMock, patch
 
 # Import salt libs
 from salt import minion
 from salt.utils import event
-from salt.exceptions import SaltSystemExit
+from salt.exceptions import SaltClientError, SaltInvocationError, SaltSystemExit
+import salt.payload
 import salt.syspaths
+import salt.utils
 
 ensure_in_syspath('../')
 
@@ -29,6 +40,656 @@ class MinionTestCase(TestCase):
         with patch.dict(__opts__, {'ipv6': False, 'master': float('127.0'), 'master_port': '4555', 'retry_dns': False}):
             self.assertRaises(SaltSystemExit, minion.resolve_dns, __opts__)
 
+    def test_resolve_dns_cache(self):
+        '''
+        A successful resolution is reused until dns_cache_ttl expires
+        '''
+        opts = {'ipv6': False, 'master': 'salt', 'master_port': '4506',
+                'retry_dns': False, 'dns_cache_ttl': 600}
+        with patch.dict(minion._DNS_CACHE, clear=True):
+            with patch('salt.utils.dns_check', MagicMock(return_value='10.0.0.1')) as dns_check:
+                self.assertEqual(minion.resolve_dns(opts)['master_ip'], '10.0.0.1')
+                self.assertEqual(minion.resolve_dns(opts)['master_ip'], '10.0.0.1')
+                self.assertEqual(dns_check.call_count, 1)
+
+                opts['dns_cache_ttl'] = 0
+                minion.resolve_dns(opts)
+                self.assertEqual(dns_check.call_count, 2)
+
+    def test_resolve_dns_retry(self):
+        '''
+        DNS retries back off like in resolve_dns_async, without retry_dns the
+        minion falls back to localhost
+        '''
+        opts = {'ipv6': False, 'master': 'salt', 'master_port': '4506',
+                'retry_dns': 30, 'dns_cache_ttl': 0}
+        dns_check = MagicMock(side_effect=[SaltClientError, SaltClientError,
+                                           SaltClientError, '10.0.0.1'])
+        with patch('salt.utils.dns_check', dns_check):
+            with patch('time.sleep', MagicMock()) as time_sleep:
+                ret = minion.resolve_dns(opts)
+        self.assertEqual(ret, {'master_ip': '10.0.0.1',
+                               'master_uri': 'tcp://10.0.0.1:4506'})
+        self.assertEqual([call[0][0] for call in time_sleep.call_args_list],
+                         [30, 60, 60])
+
+        opts['retry_dns'] = 0
+        with patch('salt.utils.dns_check', MagicMock(side_effect=SaltClientError)):
+            self.assertEqual(minion.resolve_dns(opts)['master_ip'], '127.0.0.1')
+
+        opts['master'] = ''
+        self.assertRaises(SaltSystemExit, minion.resolve_dns, opts)
+
+    def test_prep_ip_port(self):
+        '''
+        The master port is split off the master address, IPv6 addresses only
+        have a port when they are in brackets
+        '''
+        for master, expected in (
+                ('mysaltmaster', {'master': 'mysaltmaster'}),
+                ('localhost:1234', {'master': 'localhost', 'master_port': '1234'}),
+                ('localhost:salt', {'master': 'localhost:salt'}),
+                ('127.0.0.1:1234', {'master': '127.0.0.1', 'master_port': '1234'}),
+                ('::1:1234', {'master': '::1:1234'}),
+                ('[::1]:1234', {'master': '::1', 'master_port': '1234'}),
+                ('[fe80::1]', {'master': 'fe80::1'}),
+                ('fe80::1', {'master': 'fe80::1'}),
+                ('2001:db8::8:800:200c:417a', {'master': '2001:db8::8:800:200c:417a'}),
+                ('fe80::abcd', {'master': 'fe80::abcd'})):
+            opts = {'master': master, 'master_uri_format': 'default'}
+            self.assertEqual(minion.prep_ip_port(opts), expected)
+        opts = {'master': '::1:1234', 'master_uri_format': 'ip_only'}
+        self.assertEqual(minion.prep_ip_port(opts), {'master': '::1:1234'})
+
+    def test_load_args_and_kwargs(self):
+        '''
+        Positional string args are passed through untouched, key=val strings
+        and __kwarg__ dicts become kwargs
+        '''
+        def func(first, second=None):
+            pass
+
+        args, kwargs = minion.load_args_and_kwargs(
+            func,
+            ['foo: bar', 'second=[1, 2]', {'__kwarg__': True, 'first': 1}]
+        )
+        self.assertEqual(args, ['foo: bar'])
+        self.assertEqual(kwargs, {'first': 1, 'second': [1, 2]})
+
+        self.assertRaises(SaltInvocationError, minion.load_args_and_kwargs,
+                          func, ['third=3'])
+        args, kwargs = minion.load_args_and_kwargs(
+            func,
+            ['third=3', {'__kwarg__': True, 'fourth': 4}],
+            ignore_invalid=True
+        )
+        self.assertEqual((args, kwargs), ([], {}))
+
+    def test_load_args_and_kwargs_argspec_cache(self):
+        '''
+        The argspec of a function is only inspected once
+        '''
+        def func(first, second=None):
+            pass
+
+        class Unreferenceable(object):
+            __slots__ = ()
+
+            def __call__(self, first):
+                pass
+
+        with patch('salt.utils.args.get_function_argspec',
+                   MagicMock(wraps=minion.salt.utils.args.get_function_argspec)) as argspec:
+            minion.load_args_and_kwargs(func, ['first=1'])
+            minion.load_args_and_kwargs(func, ['second=2'])
+            # Objects which cannot be weakly referenced are not cached
+            minion.load_args_and_kwargs(Unreferenceable(), ['first=1'])
+            minion.load_args_and_kwargs(Unreferenceable(), ['first=1'])
+        self.assertEqual(argspec.call_count, 3)
+
+    def test_get_proc_dir_chown(self):
+        '''
+        The proc dir is only chowned when the requested owner differs
+        '''
+        cachedir = tempfile.mkdtemp()
+        try:
+            fn_ = os.path.join(cachedir, 'proc')
+            with patch('os.chown') as chown:
+                self.assertEqual(minion.get_proc_dir(cachedir), fn_)
+                self.assertTrue(os.path.isdir(fn_))
+                minion.get_proc_dir(cachedir, uid=os.getuid())
+                minion.get_proc_dir(cachedir, gid=os.getgid())
+                self.assertFalse(chown.called)
+                minion.get_proc_dir(cachedir, uid=os.getuid() + 1)
+                chown.assert_called_once_with(fn_, os.getuid() + 1, -1)
+                # The result is cached after the first call
+                minion.get_proc_dir(cachedir, uid=os.getuid() + 1)
+                self.assertEqual(chown.call_count, 1)
+        finally:
+            shutil.rmtree(cachedir)
+
+    def test_get_req_channel(self):
+        '''
+        The request channel to the master is reused by the minion's own
+        thread, other threads get a new one
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.opts = {'master_uri': 'tcp://127.0.0.1:4506'}
+        minion_._req_channel = None
+        minion_._req_channel_owner = (os.getpid(), threading.current_thread().ident)
+        with patch('salt.transport.Channel.factory',
+                   MagicMock(side_effect=lambda opts: MagicMock())) as factory:
+            channel = minion_._get_req_channel()
+            self.assertIs(minion_._get_req_channel(), channel)
+            self.assertEqual(factory.call_count, 1)
+
+            thread_channels = []
+            thread = threading.Thread(
+                target=lambda: thread_channels.append(minion_._get_req_channel())
+            )
+            thread.start()
+            thread.join()
+            self.assertIsNot(thread_channels[0], channel)
+            self.assertIs(minion_._get_req_channel(), channel)
+
+            self.assertFalse(thread_channels[0].close.called)
+            self.assertFalse(channel.close.called)
+
+            minion_.opts['master_uri'] = 'tcp://127.0.0.2:4506'
+            new_channel = minion_._get_req_channel()
+            self.assertIsNot(new_channel, channel)
+            self.assertEqual(factory.call_count, 3)
+            channel.close.assert_called_once_with()
+
+            minion_.destroy()
+            new_channel.close.assert_called_once_with()
+            self.assertIsNone(minion_._req_channel)
+
+    def test_manage_schedule_and_beacons(self):
+        '''
+        Schedule and beacon requests are dispatched to the matching method
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.serial = salt.payload.Serial({})
+        minion_.schedule = MagicMock()
+        minion_.beacons = MagicMock()
+        requests = [
+            {'func': 'modify', 'name': 'job1', 'schedule': {}, 'persist': True},
+            {'func': 'disable'},
+            {'func': 'unknown', 'name': 'job1'},
+        ]
+        with patch('salt.utils.event.MinionEvent.unpack',
+                   MagicMock(side_effect=lambda package, serial: ('tag', package))):
+            for request in requests:
+                minion_.manage_schedule(request)
+            minion_.manage_beacons({'func': 'add', 'name': 'ps',
+                                    'beacon_data': {'salt-master': 'running'}})
+        minion_.schedule.modify_job.assert_called_once_with('job1', {}, True, None)
+        minion_.schedule.disable_schedule.assert_called_once_with()
+        self.assertEqual(len(minion_.schedule.method_calls), 2)
+        minion_.beacons.add_beacon.assert_called_once_with(
+            'ps', {'salt-master': 'running'}
+        )
+
+    def test_dispatch_returners(self):
+        '''
+        Every named returner gets the return once, empty names are skipped
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.opts = {'id': 'minion'}
+        minion_.returners = {'mysql.returner': MagicMock(),
+                             'redis.returner': MagicMock()}
+        ret = {'jid': '20160101000000000000', 'return': True}
+        data = {'jid': ret['jid'], 'ret': 'mysql,redis,mysql,',
+                'ret_config': 'alternative'}
+        minion_._dispatch_returners(ret, data)
+        for returner in ('mysql.returner', 'redis.returner'):
+            minion_.returners[returner].assert_called_once_with(ret)
+        self.assertEqual(ret['id'], 'minion')
+        self.assertEqual(ret['ret_config'], 'alternative')
+
+        # a list of returners does not need to be split
+        data['ret'] = ['redis', '']
+        minion_._dispatch_returners(ret, data)
+        self.assertEqual(minion_.returners['redis.returner'].call_count, 2)
+        self.assertEqual(minion_.returners['mysql.returner'].call_count, 1)
+
+    def test_fire_master_minion_start(self):
+        '''
+        Both start events go to the master in a single request
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.opts = {'id': 'minion'}
+        minion_._fire_master = MagicMock()
+        minion_._fire_master_minion_start()
+        minion_._fire_master.assert_called_once_with(events=ANY)
+        events = minion_._fire_master.call_args[1]['events']
+        self.assertEqual([event['tag'] for event in events],
+                         ['minion_start', 'salt/minion/minion/start'])
+        for event in events:
+            self.assertEqual(event['id'], 'minion')
+            self.assertEqual(event['data'], events[0]['data'])
+
+    def test_thread_return_generator(self):
+        '''
+        The progress events of a generator are sent in batches
+        '''
+        class Functions(dict):
+            pack = {'__context__': {}}
+
+        def gen():
+            for ind in range(20):
+                yield {'key{0}'.format(ind): ind}
+
+        cachedir = tempfile.mkdtemp()
+        try:
+            minion_ = minion.Minion.__new__(minion.Minion)
+            minion_.proc_dir = cachedir
+            minion_.serial = salt.payload.Serial({})
+            minion_.functions = Functions({'test.gen': gen})
+            minion_._fire_master = MagicMock()
+            minion_._return_pub = MagicMock()
+            minion_._return_retry_timer = MagicMock(return_value=5)
+            data = {'jid': '20160101000000000000', 'fun': 'test.gen',
+                    'arg': [], 'ret': ''}
+            minion.Minion._thread_return(minion_, {'id': 'minion', 'multiprocessing': False}, data)
+        finally:
+            shutil.rmtree(cachedir)
+
+        events = []
+        for call in minion_._fire_master.call_args_list:
+            events.extend(call[1]['events'])
+        self.assertEqual(minion_._fire_master.call_count, 2)
+        self.assertEqual(len(events), 20)
+        self.assertEqual(events[-1]['tag'], 'salt/job/20160101000000000000/prog/minion/19')
+        self.assertEqual(events[-1]['data'], {'return': {'key19': 19}})
+        ret = minion_._return_pub.call_args[0][0]
+        self.assertTrue(ret['success'])
+        self.assertEqual(len(ret['return']), 20)
+
+    def test_thread_return_generator_stalled(self):
+        '''
+        The progress events of a generator stalling between its items are
+        sent by the timer without waiting for the next item
+        '''
+        class Functions(dict):
+            pack = {'__context__': {}}
+
+        fired = threading.Event()
+
+        def gen():
+            yield 'first'
+            yield 'second'
+            # stall until the pending events were sent
+            self.assertTrue(fired.wait(5))
+            yield 'third'
+
+        cachedir = tempfile.mkdtemp()
+        try:
+            minion_ = minion.Minion.__new__(minion.Minion)
+            minion_.proc_dir = cachedir
+            minion_.serial = salt.payload.Serial({})
+            minion_.functions = Functions({'test.gen': gen})
+            minion_._fire_master = MagicMock(side_effect=lambda events: fired.set())
+            minion_._return_pub = MagicMock()
+            minion_._return_retry_timer = MagicMock(return_value=5)
+            data = {'jid': '20160101000000000000', 'fun': 'test.gen',
+                    'arg': [], 'ret': ''}
+            with patch('salt.minion._PROG_EVENT_INTERVAL', 0.01):
+                minion.Minion._thread_return(minion_, {'id': 'minion', 'multiprocessing': False}, data)
+        finally:
+            shutil.rmtree(cachedir)
+
+        self.assertEqual(
+            [[event['data']['return'] for event in call[1]['events']]
+             for call in minion_._fire_master.call_args_list],
+            [['first', 'second'], ['third']]
+        )
+        self.assertEqual(minion_._return_pub.call_args[0][0]['return'],
+                         ['first', 'second', 'third'])
+
+    def test_bucket_prefixes(self):
+        '''
+        Prefixes are grouped on their first character in their original order
+        '''
+        buckets = minion._bucket_prefixes((('_salt_error', 1), ('fire_master', 2),
+                                           ('_minion_mine', 3)))
+        self.assertEqual(buckets, {'_': (('_salt_error', 1), ('_minion_mine', 3)),
+                                   'f': (('fire_master', 2),)})
+
+    def test_target_load(self):
+        '''
+        Publications are matched with the matcher of their target type
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.matcher = minion.Matcher({'id': 'minion1',
+                                          'grains': {'os': 'Linux'}})
+        load = {'tgt': 'minion*', 'jid': '20160101000000000000',
+                'fun': 'test.ping', 'arg': []}
+        self.assertTrue(minion_._target_load(load))
+        self.assertFalse(minion_._target_load(dict(load, tgt='other*')))
+        self.assertTrue(minion_._target_load(dict(load, tgt='os|Linux', tgt_type='grain',
+                                                  delimiter='|')))
+        self.assertFalse(minion_._target_load(dict(load, tgt='os:Windows', tgt_type='grain')))
+        self.assertTrue(minion_._target_load(dict(load, tgt=['minion1'], tgt_type='list')))
+        self.assertFalse(minion_._target_load(dict(load, tgt_type='unknown')))
+        self.assertFalse(minion_._target_load({'tgt': 'minion*'}))
+
+    def test_syndic_jid_forward_cache(self):
+        '''
+        The syndic forwards the load of a job once and evicts the oldest jid
+        '''
+        for syndic_class in (minion.Syndic, minion.MultiSyndic):
+            syndic = syndic_class.__new__(syndic_class)
+            syndic.opts = {'master_job_cache': 'local_cache',
+                           'syndic_jid_forward_cache_hwm': 2,
+                           'syndic_event_forward_max': 0}
+            syndic.syndic_mode = 'sync'
+            syndic.jid_forward_cache = minion.OrderedDict()
+            syndic.mminion = MagicMock()
+            get_load = MagicMock(return_value={})
+            syndic.mminion.returners = {'local_cache.get_load': get_load}
+            syndic.local = MagicMock()
+            syndic._reset_event_aggregation()
+            jids = ['20160101000000000003', '20160101000000000001',
+                    '20160101000000000002', '20160101000000000003']
+            for jid in jids:
+                tag = 'salt/job/{0}/ret/minion'.format(jid)
+                syndic.local.event.unpack.return_value = (
+                    tag, {'jid': jid, 'id': 'minion', 'return': True})
+                syndic._process_event([tag])
+                # every jid starts a new aggregation
+                syndic._reset_event_aggregation()
+            self.assertEqual(list(syndic.jid_forward_cache),
+                             ['20160101000000000002', '20160101000000000003'])
+            self.assertEqual(get_load.call_count, 4)
+
+    def test_syndic_event_forward_max(self):
+        '''
+        A full batch of events is forwarded without waiting for the timer
+        '''
+        for syndic_class in (minion.Syndic, minion.MultiSyndic):
+            syndic = syndic_class.__new__(syndic_class)
+            syndic.opts = {'syndic_event_forward_max': 3}
+            syndic.syndic_mode = 'sync'
+            syndic.local = MagicMock()
+            syndic._forward_events = MagicMock(side_effect=syndic._reset_event_aggregation)
+            syndic._reset_event_aggregation()
+            for num in range(7):
+                tag = 'custom/event/{0}'.format(num)
+                syndic.local.event.unpack.return_value = (tag, {'num': num})
+                syndic._process_event([tag])
+            self.assertEqual(syndic._forward_events.call_count, 2)
+            self.assertEqual(syndic.raw_events, [{'tag': 'custom/event/6', 'data': {'num': 6}}])
+
+    def test_syndic_forward_events(self):
+        '''
+        The syndic returns all aggregated jobs in a single request
+        '''
+        syndic = minion.Syndic.__new__(minion.Syndic)
+        syndic.opts = {'id': 'syndic', 'multiprocessing': False, 'cache_jobs': False,
+                       'return_retry_timer': 5, 'return_retry_timer_max': 5}
+        syndic.functions = {}
+        syndic._reset_event_aggregation()
+        for jid in ('20160101000000000001', '20160101000000000002'):
+            syndic.jids[jid] = {'__jid__': jid, '__fun__': 'test.ping',
+                                '__load__': {}, 'minion': True}
+        channel = MagicMock()
+        syndic._get_req_channel = MagicMock(return_value=channel)
+        syndic._forward_events()
+
+        channel.send.assert_called_once_with(ANY, timeout=5)
+        load = channel.send.call_args[0][0]
+        self.assertEqual(load['cmd'], '_syndic_return')
+        self.assertEqual(sorted(item['jid'] for item in load['load']),
+                         ['20160101000000000001', '20160101000000000002'])
+        for item in load['load']:
+            self.assertEqual(item['return'], {'minion': True})
+        self.assertEqual(syndic.jids, {})
+
+    def test_iter_master_options(self):
+        '''
+        The masters are tried in turn, starting with a different one each time
+        unless a known master is asked for
+        '''
+        syndic = minion.MultiSyndic.__new__(minion.MultiSyndic)
+        syndic._syndics = {'master1': 1, 'master2': 2, 'master3': 3}
+        syndic._syndic_masters = list(syndic._syndics)
+        syndic._master_rr = 0
+        orders = [[master for master, _ in syndic.iter_master_options()]
+                  for _ in range(3)]
+        for order in orders:
+            self.assertEqual(sorted(order), ['master1', 'master2', 'master3'])
+        self.assertEqual(sorted(order[0] for order in orders),
+                         ['master1', 'master2', 'master3'])
+
+        order = [master for master, _ in syndic.iter_master_options('master2')]
+        self.assertEqual(order[0], 'master2')
+        self.assertEqual(sorted(order), ['master1', 'master2', 'master3'])
+
+    def test_master_connected_event(self):
+        '''
+        A reconnect to the master switches the __master_alive job over
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.opts = {'master': 'salt', 'master_alive_interval': 30}
+        minion_.connected = False
+        minion_.schedule = MagicMock()
+        minion_._handle_master_connected_event('__master_connected')
+        minion_._handle_master_connected_event('__master_connected')
+        minion_.schedule.modify_job.assert_called_once_with(
+            name='__master_alive',
+            schedule={'function': 'status.master', 'seconds': 30,
+                      'jid_include': True, 'maxrunning': 2,
+                      'kwargs': {'master': 'salt', 'connected': True}})
+        self.assertTrue(minion_.connected)
+
+    def test_fallback_cleanups(self):
+        '''
+        Finished job threads are joined and dropped on Windows
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        threads = [MagicMock(), MagicMock(), MagicMock()]
+        threads[0].is_alive.return_value = False
+        threads[1].is_alive.return_value = False
+        threads[2].is_alive.return_value = True
+        minion_.win_proc = list(threads)
+        with patch('salt.utils.is_windows', MagicMock(return_value=True)):
+            minion_._fallback_cleanups()
+        self.assertEqual(minion_.win_proc, [threads[2]])
+        threads[0].join.assert_called_once_with()
+        threads[1].join.assert_called_once_with()
+        self.assertFalse(threads[2].join.called)
+
+    def test_handle_beacons(self):
+        '''
+        Beacon events are sent to the master in one request, a failing
+        beacon does not stop the loop
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.functions = {}
+        minion_._fire_master = MagicMock()
+        events = [{'tag': 'salt/beacon/minion/ps/', 'data': {}}]
+        minion_.process_beacons = MagicMock(side_effect=[events, Exception, []])
+        for _ in range(3):
+            minion_._handle_beacons()
+        minion_._fire_master.assert_called_once_with(events=events)
+
+    def test_handle_payload_stopped(self):
+        '''
+        Publications are ignored once the minion is shutting down
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_._target_load = MagicMock(return_value=True)
+        minion_._handle_decoded_payload = MagicMock()
+        payload = {'enc': 'aes', 'load': {'fun': 'test.ping'}}
+        # the flag stays None when tune_in was never called
+        minion_._running = None
+        minion_._handle_payload(payload)
+        minion_._running = False
+        minion_._handle_payload(payload)
+        minion_._handle_decoded_payload.assert_called_once_with(payload['load'])
+
+    def test_pcre_match(self):
+        '''
+        Target regexes are compiled once and match from the start of the id
+        '''
+        matcher = minion.Matcher({'id': 'web12.example.com'})
+        self.assertTrue(matcher.pcre_match(r'web\d+\.example'))
+        self.assertIn(r'web\d+\.example', minion._PCRE_CACHE)
+        self.assertTrue(matcher.pcre_match(r'web\d+\.example'))
+        self.assertFalse(matcher.pcre_match(r'example'))
+
+    def test_glob_match(self):
+        '''
+        Glob targets are translated once and behave like fnmatch
+        '''
+        matcher = minion.Matcher({'id': 'web12.example.com'})
+        self.assertTrue(matcher.glob_match('web*.example.com'))
+        self.assertIn('web*.example.com', minion._GLOB_CACHE)
+        self.assertTrue(matcher.glob_match('web*.example.com'))
+        self.assertTrue(matcher.glob_match('web[0-9]?.*'))
+        self.assertFalse(matcher.glob_match('web*.example'))
+        self.assertFalse(matcher.glob_match(['web*']))
+
+    def test_glob_match_literal(self):
+        '''
+        Globs without wildcards are compared to the id as plain strings
+        '''
+        matcher = minion.Matcher({'id': 'web12.example.com'})
+        self.assertTrue(matcher.glob_match('web12.example.com'))
+        self.assertIsNone(minion._GLOB_CACHE['web12.example.com'])
+        self.assertFalse(matcher.glob_match('web12.example'))
+        self.assertTrue(minion._fnmatch('a.b', 'a.?'))
+        self.assertFalse(minion._fnmatch('a.b', 'a.'))
+
+    def test_compound_match(self):
+        '''
+        Compound targets follow Python's boolean precedence and invalid ones
+        never match
+        '''
+        matcher = minion.Matcher({'id': 'web1'})
+        self.assertTrue(matcher.compound_match('web* and not db*'))
+        self.assertTrue(matcher.compound_match('db* or web* and E@web\\d'))
+        self.assertFalse(matcher.compound_match('not ( web* or db* )'))
+        self.assertTrue(matcher.compound_match(['(', 'db*', 'or', 'web1', ')', 'and', 'L@web1,web2']))
+        self.assertFalse(matcher.compound_match('web* db*'))
+        self.assertFalse(matcher.compound_match('( web*'))
+        self.assertFalse(matcher.compound_match('web* and'))
+        self.assertFalse(matcher.compound_match(''))
+
+    def test_compound_match_parse_target_cache(self):
+        '''
+        Each target word is parsed once, operators are not parsed at all
+        '''
+        matcher = minion.Matcher({'id': 'web1'})
+        with patch.dict(minion._TARGET_INFO_CACHE, clear=True):
+            with patch('salt.utils.minions.parse_target',
+                       MagicMock(wraps=minion.salt.utils.minions.parse_target)) as parse_target:
+                self.assertTrue(matcher.compound_match('L@web1,web2 and not E@db.*'))
+                self.assertTrue(matcher.compound_match('L@web1,web2 and not E@db.*'))
+            self.assertEqual(parse_target.call_count, 2)
+
+    def test_confirm_top(self):
+        '''
+        Top file matches are dispatched to the matcher named by the match key
+        '''
+        matcher = minion.Matcher({'id': 'web1'})
+        self.assertTrue(matcher.confirm_top('web*', ['core']))
+        self.assertTrue(matcher.confirm_top('web\\d', [{'match': 'pcre'}, 'core']))
+        self.assertFalse(matcher.confirm_top('web1', [{'match': 'unknown'}, 'core']))
+        self.assertFalse(matcher.confirm_top('web1', []))
+        self.assertTrue(matcher.confirm_top('web_servers', [{'match': 'nodegroup'}],
+                                            nodegroups={'web_servers': 'L@web1,web2'}))
+
+    def test_matcher_subclass(self):
+        '''
+        Matchers added or overridden by a Matcher subclass are used
+        '''
+        class RoleMatcher(minion.Matcher):
+            def role_match(self, tgt):
+                return tgt == self.opts['role']
+
+            def list_match(self, tgt):
+                return True
+
+        matcher = RoleMatcher({'id': 'web1', 'role': 'web'})
+        self.assertTrue(matcher.confirm_top('web', [{'match': 'role'}]))
+        self.assertFalse(matcher.confirm_top('db', [{'match': 'role'}]))
+        self.assertTrue(matcher.compound_match('L@db1 and web*'))
+        self.assertFalse(minion.Matcher({'id': 'web1'}).confirm_top('web', [{'match': 'role'}]))
+
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.matcher = matcher
+        load = {'tgt': 'web', 'jid': '20160101000000000000',
+                'fun': 'test.ping', 'arg': [], 'tgt_type': 'role'}
+        self.assertTrue(minion_._target_load(load))
+        self.assertFalse(minion_._target_load(dict(load, tgt='db')))
+
+    def test_eval_bool_tokens(self):
+        '''
+        The compound evaluator matches eval() for the tokens compound_match
+        produces
+        '''
+        for tokens in ([True, 'or', False, 'and', False],
+                       ['not', True, 'or', True],
+                       ['not', '(', False, 'and', True, ')'],
+                       ['not', 'not', False, 'or', '(', True, ')']):
+            self.assertEqual(minion._eval_bool_tokens(tokens),
+                             eval(' '.join(str(token) for token in tokens)))  # pylint: disable=W0123
+        self.assertRaises(ValueError, minion._eval_bool_tokens, [True, ')'])
+        self.assertRaises(ValueError, minion._eval_bool_tokens, ['not'])
+
+    def test_ipcidr_match(self):
+        '''
+        Address and network targets are parsed once, invalid ones never match
+        '''
+        matcher = minion.Matcher({'id': 'web1',
+                                  'grains': {'ipv4': ['127.0.0.1', '10.0.0.5']}})
+        self.assertTrue(matcher.ipcidr_match('10.0.0.5'))
+        self.assertEqual(minion._IPCIDR_CACHE['10.0.0.5'], ('ipv4', '10.0.0.5', None))
+        self.assertFalse(matcher.ipcidr_match('10.0.0.6'))
+        self.assertTrue(matcher.ipcidr_match('10.0.0.0/24'))
+        self.assertTrue(matcher.ipcidr_match('10.0.0.0/24'))
+        self.assertFalse(matcher.ipcidr_match('192.168.0.0/16'))
+        self.assertFalse(matcher.ipcidr_match('fe80::/64'))
+        self.assertEqual(matcher.ipcidr_match('10.0.0.0/33'), [])
+
+    def test_write_proc_file(self):
+        '''
+        The proc file of a job is created or truncated with the new data
+        '''
+        cachedir = tempfile.mkdtemp()
+        try:
+            fn_ = os.path.join(cachedir, '20160101000000000000')
+            minion._write_proc_file(fn_, b'first write')
+            minion._write_proc_file(fn_, b'second')
+            with salt.utils.fopen(fn_, 'rb') as fp_:
+                self.assertEqual(fp_.read(), b'second')
+        finally:
+            shutil.rmtree(cachedir)
+
+    def test_write_proc_file_removed_proc_dir(self):
+        '''
+        A cached proc dir which was removed is created again by the writer
+        '''
+        cachedir = tempfile.mkdtemp()
+        try:
+            with patch.dict(minion._PROC_DIR_CACHE, clear=True):
+                proc_dir = minion.get_proc_dir(cachedir, mode=0o700)
+                shutil.rmtree(proc_dir)
+                fn_ = os.path.join(proc_dir, '20160101000000000000')
+                minion._write_proc_file(fn_, b'data')
+                with salt.utils.fopen(fn_, 'rb') as fp_:
+                    self.assertEqual(fp_.read(), b'data')
+                self.assertEqual(os.stat(proc_dir).st_mode & 0o777, 0o700)
+                self.assertEqual(minion._PROC_DIR_CACHE,
+                                 {(cachedir, 0o700, -1, -1): proc_dir})
+                self.assertRaises(OSError, minion._write_proc_file,
+                                  os.path.join(proc_dir, 'missing', 'jid'), b'data')
+        finally:
+            shutil.rmtree(cachedir)
+
     @skipIf(os.geteuid() != 0, 'You must be logged in as root to run this test')
     def test_sock_path_len(self):
         '''
@@ -53,6 +714,279 @@ class MinionTestCase(TestCase):
         self.assertTrue(result)
 
 
+class MinionParallelConnectTestCase(tornado.testing.AsyncTestCase):
+    @tornado.testing.gen_test
+    def test_connect_any_master(self):
+        '''
+        The first master accepting the connection wins, unreachable masters are
+        skipped
+        '''
+        @tornado.gen.coroutine
+        def connect(opts, factory_kwargs):
+            if opts['master'] == 'down':
+                raise SaltClientError('unreachable')
+            if opts['master'] == 'slow':
+                yield tornado.gen.sleep(0.5)
+            opts['master_ip'] = opts['master']
+            raise tornado.gen.Return('channel-{0}'.format(opts['master']))
+
+        opts = {'master': ['down', 'slow', 'fast']}
+        base = minion.MinionBase(opts)
+        with patch.object(base, '_connect_pub_channel', connect):
+            pub_channel = yield base._connect_any_master(opts, opts['master'], {})
+        self.assertEqual(pub_channel, 'channel-fast')
+        self.assertEqual(opts['master'], 'fast')
+        self.assertEqual(opts['master_ip'], 'fast')
+
+        opts = {'master': ['down']}
+        with patch.object(base, '_connect_pub_channel', connect):
+            pub_channel = yield base._connect_any_master(opts, opts['master'], {})
+        self.assertIsNone(pub_channel)
+
+    @tornado.testing.gen_test
+    def test_connect_any_master_closes_losers(self):
+        '''
+        The channels of the masters which connect after the winner are closed
+        '''
+        channels = {}
+
+        @tornado.gen.coroutine
+        def connect(opts, factory_kwargs):
+            if opts['master'] != 'fast':
+                yield tornado.gen.sleep(0.1)
+            channels[opts['master']] = MagicMock()
+            raise tornado.gen.Return(channels[opts['master']])
+
+        opts = {'master': ['slow', 'fast', 'slower']}
+        base = minion.MinionBase(opts)
+        with patch.object(base, '_connect_pub_channel', connect):
+            pub_channel = yield base._connect_any_master(opts, opts['master'], {})
+        self.assertIs(pub_channel, channels['fast'])
+        yield tornado.gen.sleep(0.2)
+        self.assertFalse(channels['fast'].close.called)
+        channels['slow'].close.assert_called_once_with()
+        channels['slower'].close.assert_called_once_with()
+
+    @tornado.testing.gen_test
+    def test_master_shuffle_once(self):
+        '''
+        The configured master list is shuffled once, not in place
+        '''
+        masters = ['master{0}'.format(num) for num in range(10)]
+        base = minion.MinionBase({})
+        tried = []
+
+        @tornado.gen.coroutine
+        def connect(opts, local_masters, factory_kwargs):
+            tried.append(local_masters)
+
+        for _ in range(2):
+            opts = {'master': masters, 'master_type': 'failover',
+                    'master_shuffle': True, 'master_parallel_connect': True,
+                    '__role': 'minion', 'retry_dns': 0}
+            with patch.object(base, '_connect_any_master', connect):
+                with self.assertRaises(SaltClientError):
+                    yield base.eval_master(opts)
+        self.assertEqual(masters, ['master{0}'.format(num) for num in range(10)])
+        self.assertEqual(sorted(tried[0]), masters)
+        self.assertEqual(tried[0], tried[1])
+
+        with patch('salt.minion.sample', MagicMock(side_effect=sample)) as sample_mock:
+            for _ in range(2):
+                opts = {'master': masters, 'master_type': 'failover',
+                        'master_shuffle': True, 'master_parallel_connect': True,
+                        '__role': 'minion', 'retry_dns': 0}
+                with patch.object(base, '_connect_any_master', connect):
+                    with self.assertRaises(SaltClientError):
+                        yield base.eval_master(opts)
+            self.assertFalse(sample_mock.called)
+
+            other_masters = list(masters)
+            opts['master'] = other_masters
+            with patch.object(base, '_connect_any_master', connect):
+                with self.assertRaises(SaltClientError):
+                    yield base.eval_master(opts)
+            sample_mock.assert_called_once_with(other_masters, 10)
+
+    @tornado.testing.gen_test
+    def test_eval_master_dns_confirmed(self):
+        '''
+        The cached resolution of a master is renewed once the minion connected
+        to it
+        '''
+        @tornado.gen.coroutine
+        def connect():
+            pass
+
+        opts = {'master': 'salt', 'master_type': 'str', '__role': 'minion',
+                'master_port': '4506', 'master_uri_format': 'default',
+                'ipv6': False, 'retry_dns': 0, 'dns_cache_ttl': 600,
+                'file_client': 'remote'}
+        base = minion.MinionBase(opts)
+        channel = MagicMock()
+        channel.connect.side_effect = connect
+        with patch.dict(minion._DNS_CACHE, clear=True):
+            with patch('salt.utils.dns_check', MagicMock(return_value='10.0.0.1')):
+                with patch('salt.transport.client.AsyncPubChannel.factory',
+                           MagicMock(return_value=channel)):
+                    with patch('time.time', MagicMock(return_value=1000)):
+                        yield base.eval_master(opts)
+                    self.assertEqual(minion._DNS_CACHE[('salt', False)], (1000, '10.0.0.1'))
+                    with patch('time.time', MagicMock(return_value=1500)):
+                        yield base.eval_master(opts)
+                    self.assertEqual(minion._DNS_CACHE[('salt', False)], (1500, '10.0.0.1'))
+
+                    channel.connect.side_effect = SaltClientError
+                    with patch('time.time', MagicMock(return_value=1900)):
+                        with self.assertRaises(SaltClientError):
+                            yield base.eval_master(opts)
+                    self.assertEqual(minion._DNS_CACHE[('salt', False)], (1500, '10.0.0.1'))
+
+    @tornado.testing.gen_test
+    def test_resolve_dns_async_retry(self):
+        '''
+        DNS retries back off on the IO loop instead of blocking it
+        '''
+        @tornado.gen.coroutine
+        def sleep(seconds):
+            pass
+
+        opts = {'ipv6': False, 'master': 'salt', 'master_port': '4506',
+                'retry_dns': 30, 'dns_cache_ttl': 0}
+        dns_check = MagicMock(side_effect=[SaltClientError, SaltClientError,
+                                           SaltClientError, '10.0.0.1'])
+        sleep_mock = MagicMock(side_effect=sleep)
+        time_sleep = MagicMock()
+        with patch('salt.utils.dns_check', dns_check):
+            with patch('tornado.gen.sleep', sleep_mock):
+                with patch('time.sleep', time_sleep):
+                    ret = yield minion.resolve_dns_async(opts)
+        self.assertEqual(ret, {'master_ip': '10.0.0.1',
+                               'master_uri': 'tcp://10.0.0.1:4506'})
+        self.assertEqual([call[0][0] for call in sleep_mock.call_args_list],
+                         [30, 60, 60])
+        self.assertFalse(time_sleep.called)
+
+
+class MinionProcessCountTestCase(tornado.testing.AsyncTestCase):
+    @tornado.testing.gen_test
+    def test_process_count_max(self):
+        '''
+        Publications wait for a free slot when process_count_max is reached and
+        are started in the order they came in
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.opts = {'process_count_max': 2, 'multiprocessing': False}
+        minion_.io_loop = self.io_loop
+        minion_._pending_jobs = collections.deque()
+        jids = ['2016010100000000000{0}'.format(num) for num in range(3)]
+        running = MagicMock(return_value=[{}, {}])
+        thread_mock = MagicMock()
+        with patch('salt.utils.minion.running', running):
+            with patch('threading.Thread', thread_mock):
+                with patch('salt.minion._PROCESS_COUNT_INTERVAL', 0.01):
+                    for jid in jids:
+                        minion_._handle_decoded_payload({'fun': 'test.ping', 'jid': jid})
+                    yield tornado.gen.sleep(0.05)
+                    self.assertFalse(thread_mock.called)
+                    self.assertEqual(len(minion_._pending_jobs), 3)
+
+                    running.return_value = [{}]
+                    yield tornado.gen.sleep(0.05)
+                    self.assertEqual([call[1]['name'] for call in thread_mock.call_args_list],
+                                     jids)
+        self.assertFalse(minion_._pending_jobs)
+        # the job threads must not block the IO loop
+        self.assertFalse(thread_mock.return_value.join.called)
+
+    def test_process_count_max_free_slot(self):
+        '''
+        A publication is started right away while there is a free slot, errors
+        starting it reach the caller
+        '''
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.opts = {'process_count_max': 2, 'multiprocessing': False}
+        minion_._pending_jobs = collections.deque()
+        thread_mock = MagicMock()
+        with patch('salt.utils.minion.running', MagicMock(return_value=[{}])):
+            with patch('threading.Thread', thread_mock):
+                minion_._handle_decoded_payload({'fun': 'test.ping', 'jid': '20160101000000000000'})
+                thread_mock.return_value.start.assert_called_once_with()
+                thread_mock.return_value.start.side_effect = RuntimeError
+                self.assertRaises(RuntimeError, minion_._handle_decoded_payload,
+                                  {'fun': 'test.ping', 'jid': '20160101000000000001'})
+
+
+class MinionEventTestCase(tornado.testing.AsyncTestCase):
+    @tornado.testing.gen_test
+    def test_handle_event(self):
+        '''
+        Local events are dispatched on their tag, also when the tag only
+        starts with a known one. Only coroutine handlers return a future.
+        '''
+        @tornado.gen.coroutine
+        def refresh():
+            refreshed.append(True)
+
+        refreshed = []
+        minion_ = minion.Minion.__new__(minion.Minion)
+        minion_.serial = salt.payload.Serial({})
+        minion_.manage_schedule = MagicMock()
+        minion_._mine_send = MagicMock(return_value={'ret': True})
+        minion_.pillar_refresh = MagicMock(side_effect=refresh)
+
+        def package(tag, data):
+            return '{0}{1}{2}'.format(tag, event.TAGEND,
+                                      minion_.serial.dumps(data))
+
+        schedule = package('manage_schedule', {'func': 'list'})
+        self.assertIsNone(minion_.handle_event(schedule))
+        minion_.manage_schedule.assert_called_once_with(schedule)
+
+        mine = package('_minion_mine_extra', {})
+        self.assertIsNone(minion_.handle_event(mine))
+        minion_._mine_send.assert_called_once_with(mine)
+
+        yield minion_.handle_event(package('pillar_refresh', {}))
+        self.assertEqual(refreshed, [True])
+
+        self.assertIsNone(minion_.handle_event(package('unknown', {})))
+        self.assertEqual(minion_.manage_schedule.call_count, 1)
+
+
+class MultiSyndicConnectTestCase(tornado.testing.AsyncTestCase):
+    @tornado.testing.gen_test
+    def test_connect_syndic_backoff(self):
+        '''
+        Failed connection attempts back off, also after unexpected errors
+        '''
+        @tornado.gen.coroutine
+        def sleep(seconds):
+            pass
+
+        @tornado.gen.coroutine
+        def connect_master():
+            pass
+
+        multi = minion.MultiSyndic.__new__(minion.MultiSyndic)
+        multi.io_loop = self.io_loop
+        multi.auth_wait = 10
+        multi.max_auth_wait = 25
+        syndic = MagicMock()
+        syndic.connect_master = connect_master
+        syndic_cls = MagicMock(side_effect=[SaltClientError, ValueError,
+                                            SaltClientError, syndic])
+        sleep_mock = MagicMock(side_effect=sleep)
+        with patch('salt.minion.Syndic', syndic_cls):
+            with patch('tornado.gen.sleep', sleep_mock):
+                ret = yield multi._connect_syndic({'master': 'salt',
+                                                   'acceptance_wait_time': 10})
+        self.assertIs(ret, syndic)
+        self.assertEqual([call[0][0] for call in sleep_mock.call_args_list],
+                         [20, 30, 30])
+        syndic.tune_in_no_block.assert_called_once_with()
+
+
 if __name__ == '__main__':
     from integration import run_tests
     run_tests(MinionTestCase, needs_daemon=False)
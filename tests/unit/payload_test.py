@@ -49,7 +49,10 @@ class PayloadTestCase(TestCase):
             for chunk in data:
                 self.assertNoOrderedDict(chunk)
 
-    def test_list_nested_odicts(self):
+    # Go through msgpack.dumps instead of the cached packer so the forced
+    # TypeError below is hit
+    @patch('salt.payload._get_packer', return_value=None)
+    def test_list_nested_odicts(self, get_packer):
         with patch('msgpack.version', (0, 1, 13)):
             msgpack.dumps = MockWraps(
                 msgpack.dumps, 1, TypeError('ODict TypeError Forced')
@@ -60,6 +63,29 @@ class PayloadTestCase(TestCase):
             self.assertNoOrderedDict(odata)
             self.assertEqual(idata, odata)
 
+    def test_dumps_reuses_packer(self):
+        '''
+        Serial.dumps reuses one packer per thread and replaces it after a
+        failed pack
+        '''
+        payload = salt.payload.Serial('msgpack')
+        data = {'fun': 'test.ping', 'return': True}
+        self.assertEqual(payload.loads(payload.dumps(data)), data)
+        packer = salt.payload._get_packer()
+        self.assertIs(salt.payload._get_packer(), packer)
+
+        thread_packers = []
+        thread = threading.Thread(
+            target=lambda: thread_packers.append(salt.payload._get_packer())
+        )
+        thread.start()
+        thread.join()
+        self.assertIsNot(thread_packers[0], packer)
+
+        self.assertRaises(TypeError, payload.dumps, {'unpackable': object()})
+        self.assertIsNot(salt.payload._get_packer(), packer)
+        self.assertEqual(payload.loads(payload.dumps(data)), data)
+
 
 class SREQTestCase(TestCase):
     port = 8845  # TODO: dynamically assign a port?